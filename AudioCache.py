@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from MetadataCache import MetadataCache
+
+
+# Keeps Opus-encoded copies of frequently played tracks on disk within a byte budget.
+class AudioCache:
+    def __init__(self, directory, max_bytes, policy='lru', min_plays=1, max_duration=900, bitrate='96k',
+                 workers=1, executable='ffmpeg'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.min_plays = min_plays
+        self.max_duration = max_duration
+        self.bitrate = bitrate
+        self.executable = executable
+        self.index_path = os.path.join(directory, 'index.json')
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.entries = {}  # key -> dict(file, size, last_access, plays)
+        self.plays = {}  # key -> plays of tracks that are not cached yet
+        self.populating = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    # Returns the cache key of the Track.
+    @staticmethod
+    def key(track):
+        return MetadataCache.normalize(track.url)
+
+    # Returns the path of the cached audio for the Track, or None.
+    def path_for(self, track):
+        key = AudioCache.key(track)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                path = os.path.join(self.directory, entry['file'])
+                if os.path.isfile(path):
+                    entry['last_access'] = time.time()
+                    entry['plays'] += 1
+                    self.hits += 1
+                    return path
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    # Counts a live play of the Track and starts caching it in the background once it is played often enough.
+    def played_live(self, loop, track):
+        if track.stream_url is None or track.duration is None or track.duration > self.max_duration:
+            return None
+        key = AudioCache.key(track)
+        with self.lock:
+            if key in self.entries or key in self.populating:
+                return None
+            plays = self.plays.pop(key, 0) + 1
+            if plays < self.min_plays:
+                self.plays[key] = plays
+                # Only remember play counts for as many tracks as could be cached.
+                if len(self.plays) > 10000:
+                    self.plays.pop(next(iter(self.plays)))
+                return None
+            self.populating.add(key)
+        return loop.run_in_executor(self.pool, self.populate, key, track.stream_url, plays)
+
+    # Encodes the stream to Opus at Discord's 20 ms frame size; runs on the cache's own worker.
+    def populate(self, key, stream_url, plays):
+        file_name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.opus'
+        path = os.path.join(self.directory, file_name)
+        temp_path = path + '.part'
+        try:
+            subprocess.check_call([
+                self.executable, '-nostdin', '-loglevel', 'error', '-y',
+                '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                '-i', stream_url,
+                '-vn', '-ac', '2', '-ar', '48000', '-c:a', 'libopus', '-b:a', self.bitrate,
+                '-frame_duration', '20', '-f', 'opus', temp_path
+            ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(temp_path, path)
+        except (OSError, subprocess.CalledProcessError):
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            with self.lock:
+                self.populating.discard(key)
+
+        with self.lock:
+            self.entries[key] = dict(file=file_name, size=os.path.getsize(path), last_access=time.time(),
+                                     plays=plays)
+            self.evict()
+            self.save()
+
+    # Removes entries until the cache fits in its budget; must be called with the lock held.
+    def evict(self):
+        total = sum(entry['size'] for entry in self.entries.values())
+        if total <= self.max_bytes:
+            return
+        if self.policy == 'lfu':
+            order = sorted(self.entries, key=lambda k: (self.entries[k]['plays'], self.entries[k]['last_access']))
+        else:
+            order = sorted(self.entries, key=lambda k: self.entries[k]['last_access'])
+        for key in order:
+            if total <= self.max_bytes:
+                break
+            entry = self.entries.pop(key)
+            total -= entry['size']
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except OSError:
+                pass
+
+    # Writes the index; must be called with the lock held.
+    def save(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as index_file:
+            json.dump(self.entries, index_file)
+        os.replace(temp_path, self.index_path)
+
+    # Loads the index, dropping entries whose file is gone.
+    def load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path) as index_file:
+                entries = json.load(index_file)
+        except ValueError:
+            return
+        for key, entry in entries.items():
+            if os.path.isfile(os.path.join(self.directory, entry['file'])):
+                self.entries[key] = entry
+        with self.lock:
+            self.evict()
+
+    # Returns the hit/miss counters and how much of the budget is used.
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self.entries),
+                        bytes=sum(entry['size'] for entry in self.entries.values()), max_bytes=self.max_bytes,
+                        populating=len(self.populating))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
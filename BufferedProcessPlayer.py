@@ -0,0 +1,57 @@
+import time
+import audioop
+from discord.voice_client import ProcessPlayer
+
+
+# FFmpeg player that reads its PCM from a ReadAheadBuffer, if one is given, or straight from FFmpeg. Like
+# FramePlayer, it carries on at the normal pace after the buffer ran dry, where StreamPlayer would send the
+# backlog in a burst to catch up, and counts the frames it sent, which StreamPlayer resets on resume.
+class BufferedProcessPlayer(ProcessPlayer):
+    def __init__(self, process, voice_client, read_ahead=None, after=None, **kwargs):
+        super().__init__(process, voice_client, after, **kwargs)
+        self.read_ahead = read_ahead
+        if read_ahead is not None:
+            self.buff = read_ahead
+        self.frames_sent = 0
+        # Optional callable run on the player's thread once the first frame has been sent.
+        self.on_first_frame = None
+
+    # Same as StreamPlayer's, apart from the pacing after an underrun and the frame count.
+    def _do_run(self):
+        self.loops = 0
+        self._start = time.time()
+        while not self._end.is_set():
+            # Are we paused?
+            if not self._resumed.is_set():
+                self._resumed.wait()
+
+            if not self._connected.is_set():
+                self.stop()
+                break
+
+            self.loops += 1
+            underruns = None if self.read_ahead is None else self.read_ahead.underruns
+            data = self.buff.read(self.frame_size)
+
+            if self._volume != 1.0:
+                data = audioop.mul(data, 2, min(self._volume, 2.0))
+
+            if len(data) != self.frame_size:
+                self.stop()
+                break
+            if underruns is not None and self.read_ahead.underruns != underruns:
+                self._start = time.time() - self.delay * self.loops
+
+            self.player(data)
+            self.frames_sent += 1
+            if self.frames_sent == 1 and self.on_first_frame is not None:
+                self.on_first_frame()
+            next_time = self._start + self.delay * self.loops
+            delay = max(0, self.delay + (next_time - time.time()))
+            time.sleep(delay)
+
+    def stop(self):
+        super().stop()
+        # Wakes the player if it is waiting for audio.
+        if self.read_ahead is not None:
+            self.read_ahead.close()
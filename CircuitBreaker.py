@@ -0,0 +1,80 @@
+import time
+from collections import deque
+
+
+# Per-backend circuit breaker: once a backend's recent error rate crosses the threshold, calls to it fail fast
+# until a single trial call is let through after an exponentially growing backoff.
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window=20, threshold=0.5, min_calls=5, backoff=5, max_backoff=300):
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.backends = {}
+        self.rejected = 0
+        self.opened = 0
+
+    def state(self, backend):
+        if backend not in self.backends:
+            self.backends[backend] = dict(state=CircuitBreaker.CLOSED, results=deque(maxlen=self.window),
+                                          open_until=0, backoff=self.backoff, trial=False)
+        return self.backends[backend]
+
+    # Returns True if a call to the backend may go ahead.
+    def allow(self, backend, now=None):
+        if now is None:
+            now = time.time()
+        state = self.state(backend)
+        if state['state'] == CircuitBreaker.CLOSED:
+            return True
+        if state['state'] == CircuitBreaker.OPEN and now >= state['open_until']:
+            state['state'] = CircuitBreaker.HALF_OPEN
+            state['trial'] = False
+        if state['state'] == CircuitBreaker.HALF_OPEN and not state['trial']:
+            state['trial'] = True
+            return True
+        self.rejected += 1
+        return False
+
+    # Gives up a call that was allowed without an outcome, e.g. because it was cancelled, so a half-open
+    # backend lets the next call through as its trial.
+    def release(self, backend):
+        state = self.state(backend)
+        if state['state'] == CircuitBreaker.HALF_OPEN:
+            state['trial'] = False
+
+    # Records the outcome of a call that was allowed.
+    def record(self, backend, success, now=None):
+        if now is None:
+            now = time.time()
+        state = self.state(backend)
+        if state['state'] == CircuitBreaker.HALF_OPEN:
+            if success:
+                state['state'] = CircuitBreaker.CLOSED
+                state['results'].clear()
+                state['backoff'] = self.backoff
+            else:
+                state['backoff'] = min(state['backoff'] * 2, self.max_backoff)
+                self.open(state, now)
+            return
+
+        state['results'].append(success)
+        failures = state['results'].count(False)
+        if len(state['results']) >= self.min_calls and failures / len(state['results']) >= self.threshold:
+            self.open(state, now)
+
+    def open(self, state, now):
+        state['state'] = CircuitBreaker.OPEN
+        state['open_until'] = now + state['backoff']
+        state['results'].clear()
+        self.opened += 1
+
+    # Returns the state of every backend along with the rejected and opened counters.
+    def stats(self):
+        return dict(rejected=self.rejected, opened=self.opened,
+                    backends=dict((backend, state['state']) for backend, state in self.backends.items()))
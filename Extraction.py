@@ -0,0 +1,112 @@
+import os
+import threading
+from YoutubeDLPool import YoutubeDLPool
+
+
+# youtube-dl work that the ExtractionScheduler runs on its workers.
+# Everything here is a module level function so it can also be sent to a process pool.
+
+# YoutubeDLPool per option profile ('track' or 'playlist') of the current process.
+pools = {}
+pools_pid = None
+pools_lock = threading.Lock()
+
+
+# Options used for single track extraction.
+def track_ytdl_options():
+    return dict(
+        format="bestaudio/best",
+        extractaudio=True,
+        audioformat="mp3",
+        noplaylist=True,
+        default_search="auto",
+        quiet=True,
+        nocheckcertificate=True,
+        # Errors are raised so a dead video can be told apart from a failing backend.
+        ignoreerrors=False,
+        no_warnings=True,
+    )
+
+
+# Options used to enumerate playlists without resolving each video's page.
+def playlist_ytdl_options():
+    return dict(
+        ignoreerrors=True,
+        noplaylist=False,
+        default_search="auto",
+        quiet=True,
+        nocheckcertificate=True,
+        abortonerror=False,
+        extract_flat='in_playlist'
+    )
+
+
+# Messages of youtube-dl errors caused by the backend rather than by the requested video: 5xx, 429, timeouts
+# and connection errors. 'Unable to download' and 'unable to extract' also prefix 403/404s and broken pages of
+# a single video, so they are not enough on their own.
+BACKEND_ERRORS = ('HTTP Error 5', 'HTTP Error 429', 'timed out', 'urlopen error', 'Connection reset',
+                  'Connection refused', 'Connection aborted', 'Remote end closed connection', 'Temporary failure')
+
+
+# Returns True if the extraction error points at the backend (e.g. HTTP 500s) rather than the video itself.
+def is_backend_error(exception):
+    message = str(exception)
+    return any(error.lower() in message.lower() for error in BACKEND_ERRORS)
+
+
+# Returns the pool of YoutubeDL instances for the profile; pools inherited from a parent process are replaced.
+def pool(profile):
+    global pools, pools_pid
+    with pools_lock:
+        if pools_pid != os.getpid():
+            pools = {}
+            pools_pid = os.getpid()
+        ytdl_pool = pools.get(profile)
+        if ytdl_pool is None:
+            options = track_ytdl_options() if profile == 'track' else playlist_ytdl_options()
+            ytdl_pool = YoutubeDLPool(options)
+            pools[profile] = ytdl_pool
+        return ytdl_pool
+
+
+# Creates and warms YoutubeDL instances ahead of the first jobs; returns the process id it ran in.
+def warm_pools(track_instances, playlist_instances=1):
+    pool('track').warm(track_instances)
+    pool('playlist').warm(playlist_instances)
+    return os.getpid()
+
+
+# Returns the youtube-dl info for the source.
+def extract_track_info(source):
+    with pool('track').instance() as ytdl:
+        return ytdl.extract_info(source, download=False)
+
+
+# Yields (total, entry) for every entry of the playlist as it is paged through; total is None until known.
+def iterate_playlist(source):
+    with pool('playlist').instance() as ytdl:
+        ytdl_playlist = ytdl.extract_info(source, download=False, process=False)
+        # Links such as watch?v=...&list=... redirect to the playlist extractor.
+        while ytdl_playlist is not None and ytdl_playlist.get('_type') in ('url', 'url_transparent'):
+            ytdl_playlist = ytdl.extract_info(ytdl_playlist['url'], download=False,
+                                              ie_key=ytdl_playlist.get('ie_key'), process=False)
+        if ytdl_playlist is None:
+            return
+
+        if 'entries' not in ytdl_playlist:
+            yield 1, ytdl_playlist
+            return
+
+        entries = ytdl_playlist['entries']
+        if hasattr(entries, 'getslice'):
+            entries = entries.getslice()
+        total = len(entries) if isinstance(entries, list) else None
+        # YouTube playlists yield their entries page by page.
+        for video in entries:
+            if video is not None:
+                yield total, video
+
+
+# Returns every (total, entry) of the playlist at once, for workers that cannot stream back.
+def list_playlist(source):
+    return list(iterate_playlist(source))
@@ -0,0 +1,146 @@
+import time
+import functools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+# Runs youtube-dl jobs on a bounded worker pool, by priority and round-robin between servers.
+class ExtractionScheduler:
+    INTERACTIVE = 0  # -play requests and tracks that are about to start.
+    PREFETCH = 1  # Upcoming tracks resolved ahead of time.
+    BULK = 2  # Playlist enumeration and playlist entries.
+    PRIORITY_NAMES = ('interactive', 'prefetch', 'bulk')
+
+    def __init__(self, loop, workers=4, executor='thread'):
+        self.loop = loop
+        self.workers = workers
+        self.executor = executor
+        self.thread_pool = ThreadPoolExecutor(max_workers=workers)
+        self.process_pool = None
+        if executor == 'process':
+            self.process_pool = ProcessPoolExecutor(max_workers=workers)
+        # One OrderedDict of server id -> deque of jobs per priority; the order of the keys is the round-robin.
+        self.pending = [OrderedDict() for _ in ExtractionScheduler.PRIORITY_NAMES]
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits = deque(maxlen=100)
+        self.cancellations = {}  # server id -> number of times its jobs were cancelled
+        # Optional callable(priority, wait, run_time, failed) told about every finished job.
+        self.observer = None
+
+    # Queues func(*args) for the server and returns an asyncio.Future with its result.
+    # Jobs with in_thread=True always run on the thread pool (e.g. ones that call back into the event loop).
+    def submit(self, server_id, priority, func, *args, in_thread=False):
+        future = self.loop.create_future()
+        servers = self.pending[priority]
+        if server_id not in servers:
+            servers[server_id] = deque()
+        servers[server_id].append((future, func, args, in_thread, time.time(), priority))
+        self.dispatch()
+        return future
+
+    # Moves a queued job up to the priority, in the server's turn; returns False if the job is not queued below
+    # that priority, e.g. because it already started.
+    def promote(self, future, server_id, priority):
+        for lower in range(priority + 1, len(self.pending)):
+            servers = self.pending[lower]
+            for queued_server_id, jobs in servers.items():
+                for job in jobs:
+                    if job[0] is future:
+                        jobs.remove(job)
+                        if len(jobs) == 0:
+                            del servers[queued_server_id]
+                        if server_id not in self.pending[priority]:
+                            self.pending[priority][server_id] = deque()
+                        self.pending[priority][server_id].append(job[:5] + (priority,))
+                        self.dispatch()
+                        return True
+        return False
+
+    # Returns True if jobs can be handed objects that live in this process.
+    def streams(self):
+        return self.process_pool is None
+
+    # Starts queued jobs while there are free workers.
+    def dispatch(self):
+        while self.running < self.workers:
+            job = self.next_job()
+            if job is None:
+                return
+            future, func, args, in_thread, queued_at, priority = job
+            if future.cancelled():
+                continue
+
+            wait = time.time() - queued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.recent_waits.append(wait)
+
+            pool = self.thread_pool if in_thread or self.process_pool is None else self.process_pool
+            self.running += 1
+            work = self.loop.run_in_executor(pool, func, *args)
+            work.add_done_callback(functools.partial(self.job_done, future=future, priority=priority, wait=wait,
+                                                     started_at=time.time()))
+
+    # Pops the next job: highest priority first, then the next server in turn.
+    def next_job(self):
+        for servers in self.pending:
+            while len(servers) > 0:
+                server_id, jobs = next(iter(servers.items()))
+                job = jobs.popleft()
+                if len(jobs) == 0:
+                    del servers[server_id]
+                else:
+                    servers.move_to_end(server_id)
+                return job
+        return None
+
+    def job_done(self, work, future, priority, wait, started_at):
+        self.running -= 1
+        if self.observer is not None:
+            self.observer(priority, wait, time.time() - started_at, work.exception() is not None)
+        if work.exception() is not None:
+            self.failed += 1
+            if not future.cancelled():
+                future.set_exception(work.exception())
+        else:
+            self.completed += 1
+            if not future.cancelled():
+                future.set_result(work.result())
+        self.dispatch()
+
+    # Drops every job of the server that has not started yet.
+    def cancel_server(self, server_id):
+        self.cancellations[server_id] = self.cancellations.get(server_id, 0) + 1
+        for servers in self.pending:
+            for future, func, args, in_thread, queued_at, priority in servers.pop(server_id, []):
+                future.cancel()
+
+    # Returns the number of jobs waiting per priority.
+    def depth(self):
+        return dict((name, sum(len(jobs) for jobs in self.pending[priority].values()))
+                    for priority, name in enumerate(ExtractionScheduler.PRIORITY_NAMES))
+
+    # Returns the figures needed to size the pool.
+    def stats(self):
+        started = self.completed + self.failed + self.running
+        recent = sorted(self.recent_waits)
+        return dict(
+            workers=self.workers,
+            executor=self.executor,
+            running=self.running,
+            queued=self.depth(),
+            completed=self.completed,
+            failed=self.failed,
+            wait_avg=self.wait_total / started if started > 0 else 0.0,
+            wait_max=self.wait_max,
+            wait_p90=recent[int(len(recent) * 0.9)] if len(recent) > 0 else 0.0
+        )
+
+    def shutdown(self):
+        self.thread_pool.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
@@ -0,0 +1,67 @@
+import time
+from discord.voice_client import StreamPlayer
+
+
+# Player that sends already encoded Opus frames, e.g. from an OpusBroadcast shared with other servers.
+class FramePlayer(StreamPlayer):
+    def __init__(self, voice_client, broadcaster, broadcast, listener, after=None, read_ahead=None, **kwargs):
+        super().__init__(None, voice_client.encoder, voice_client._connected, self.send, after, **kwargs)
+        self.voice_client = voice_client
+        self.broadcaster = broadcaster
+        self.broadcast = broadcast
+        self.listener = listener
+        self.frames_sent = 0
+        # Optional callable run on the player's thread once the first frame has been sent.
+        self.on_first_frame = None
+        # Optional ReadAheadBuffer filled from the broadcast.
+        self.read_ahead = read_ahead
+
+    def read_frame(self):
+        if self.read_ahead is not None:
+            return self.read_ahead.read()
+        return self.broadcast.read(self.listener)
+
+    def send(self, frame):
+        self.voice_client.play_audio(frame, encode=False)
+
+    # Same pacing as StreamPlayer, but frames come from the broadcast instead of a PCM pipe.
+    def _do_run(self):
+        self.loops = 0
+        self._start = time.time()
+        while not self._end.is_set():
+            # Are we paused?
+            if not self._resumed.is_set():
+                self._resumed.wait()
+
+            if not self._connected.is_set():
+                self.stop()
+                break
+
+            self.loops += 1
+            underruns = None if self.read_ahead is None else self.read_ahead.underruns
+            frame = self.read_frame()
+            if not frame:
+                self.stop()
+                break
+            if underruns is not None and self.read_ahead.underruns != underruns:
+                # Carry on at the normal pace after waiting for frames, instead of catching up in a burst.
+                self._start = time.time() - self.delay * self.loops
+
+            self.player(frame)
+            self.frames_sent += 1
+            if self.frames_sent == 1 and self.on_first_frame is not None:
+                self.on_first_frame()
+            next_time = self._start + self.delay * self.loops
+            delay = max(0, self.delay + (next_time - time.time()))
+            time.sleep(delay)
+
+    def run(self):
+        super().run()
+        self.broadcaster.unsubscribe(self.broadcast, self.listener)
+
+    def stop(self):
+        super().stop()
+        # Wakes the player if it is waiting for the next frame.
+        self.broadcaster.unsubscribe(self.broadcast, self.listener)
+        if self.read_ahead is not None:
+            self.read_ahead.close()
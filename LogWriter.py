@@ -0,0 +1,99 @@
+import os
+import json
+import queue
+import threading
+import traceback
+
+
+# Writes log records as JSON lines from a background thread, in batches, and rotates the file by size.
+# Records are dropped and counted while the queue is full, so logging never blocks the event loop.
+class LogWriter:
+    CLOSE = object()
+
+    def __init__(self, path, max_bytes=10485760, backups=3, queue_size=10000, batch_size=256):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.thread = threading.Thread(target=self.run, name='LogWriter', daemon=True)
+        self.thread.start()
+
+    # Queues a record, a dict of JSON values; an exception under 'exception' is written with its traceback.
+    def write(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not LogWriter.CLOSE]
+            if len(records) > 0:
+                try:
+                    self.write_batch(records)
+                except (OSError, TypeError, ValueError):
+                    with self.lock:
+                        self.dropped += len(records)
+            if len(records) < len(batch):
+                return
+
+    def write_batch(self, records):
+        lines = ''.join(json.dumps(LogWriter.encode(record), default=str) + '\n' for record in records)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self.rotate()
+        with open(self.path, 'a', encoding='utf-8') as log_file:
+            log_file.write(lines)
+        with self.lock:
+            self.written += len(records)
+
+    # Formats the record's exception here rather than on the thread that logged it.
+    @staticmethod
+    def encode(record):
+        exception = record.get('exception')
+        if not isinstance(exception, BaseException):
+            return record
+        record = dict(record)
+        record['exception'] = type(exception).__name__
+        record['message'] = str(exception)
+        # Command errors wrap the exception the command raised.
+        original = getattr(exception, 'original', exception)
+        record['traceback'] = ''.join(traceback.format_exception(type(original), original, original.__traceback__))
+        return record
+
+    # Renames path.1 to path.2 and so on, and the log to path.1; the oldest backup is replaced.
+    def rotate(self):
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                backup = '{}.{}'.format(self.path, index)
+                if os.path.exists(backup):
+                    os.replace(backup, '{}.{}'.format(self.path, index + 1))
+            os.replace(self.path, '{}.1'.format(self.path))
+        else:
+            os.remove(self.path)
+        with self.lock:
+            self.rotations += 1
+
+    # Writes the queued records and stops the writer thread.
+    def close(self, timeout=5):
+        try:
+            self.queue.put(LogWriter.CLOSE, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            return dict(written=self.written, dropped=self.dropped, rotations=self.rotations,
+                        queued=self.queue.qsize())
@@ -0,0 +1,96 @@
+import asyncio
+from collections import OrderedDict
+
+
+# Rate limited delivery of progress edits and notices.
+# Only the latest content of each message is kept and repeated notices are summarized in one message,
+# so progress updates never use up the rate limit that command replies need.
+class MessageCoalescer:
+    def __init__(self, bot, interval=2.0, rate=1.0, notice_delay=5.0, on_error=None):
+        self.bot = bot
+        self.interval = interval  # Minimum seconds between edits of the same message.
+        self.gap = 1.0 / rate  # Minimum seconds between any two requests made here.
+        self.notice_delay = notice_delay
+        self.on_error = on_error
+        self.edits = OrderedDict()  # message id -> (message, content)
+        self.last_edit = {}  # message id -> loop time of its last edit
+        self.notices = OrderedDict()  # (channel id, header) -> (channel, header, items, loop time of first item)
+        self.wakeup = asyncio.Event()
+        self.coalesced = 0
+        self.sent = 0
+        self.task = None
+
+    def start(self, loop):
+        self.task = loop.create_task(self.run())
+
+    # Replaces the pending content of the message.
+    def edit(self, message, content):
+        if message.id in self.edits:
+            self.coalesced += 1
+        self.edits[message.id] = (message, content)
+        self.wakeup.set()
+
+    # Adds an item to the channel's summary for the header, e.g. every song that could not be queued.
+    def notice(self, channel, header, item):
+        key = (channel.id, header)
+        if key in self.notices:
+            self.notices[key][2].append(item)
+            self.coalesced += 1
+        else:
+            self.notices[key] = (channel, header, [item], self.bot.loop.time())
+        self.wakeup.set()
+
+    # Sends the message's pending edit and its channel's notices right away.
+    async def flush(self, message):
+        pending = self.edits.pop(message.id, None)
+        self.last_edit.pop(message.id, None)
+        if pending is not None:
+            await self.send_edit(*pending)
+        for key in [key for key in self.notices if key[0] == message.channel.id]:
+            await self.send_notice(*self.notices.pop(key)[:3])
+
+    async def run(self):
+        while not self.bot.is_closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while len(self.edits) > 0 or len(self.notices) > 0:
+                now = self.bot.loop.time()
+                sent = await self.send_due(now)
+                await asyncio.sleep(self.gap if sent else min(self.gap, self.interval))
+
+    # Sends the first edit or notice that is due; returns False if nothing was.
+    async def send_due(self, now):
+        for message_id, (message, content) in self.edits.items():
+            if now - self.last_edit.get(message_id, 0) >= self.interval:
+                del self.edits[message_id]
+                self.last_edit[message_id] = now
+                await self.send_edit(message, content)
+                return True
+        for key, (channel, header, items, first) in self.notices.items():
+            if now - first >= self.notice_delay:
+                del self.notices[key]
+                await self.send_notice(channel, header, items)
+                return True
+        # Forget edit times that no longer hold anything back.
+        for message_id in [m for m, t in self.last_edit.items() if now - t >= self.interval]:
+            del self.last_edit[message_id]
+        return False
+
+    async def send_edit(self, message, content):
+        try:
+            await self.bot.edit_message(message, content)
+            self.sent += 1
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(e)
+
+    async def send_notice(self, channel, header, items):
+        shown = ', '.join(str(item) for item in items[:10])
+        if len(items) > 10:
+            shown += ' and {} more'.format(len(items) - 10)
+        try:
+            await self.bot.send_message(channel, '{} ({}): {}'.format(header, len(items), shown))
+            self.sent += 1
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(e)
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from Track import Track
+
+
+# Bounded mapping whose entries expire; the least recently used entry is evicted first.
+class TTLCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now=None):
+        if now is None:
+            now = time.time()
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= now:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    # Stores the value until expires_at, or for the cache's ttl if no expiry is given.
+    def put(self, key, value, expires_at=None):
+        ttl_expiry = time.time() + self.ttl
+        if expires_at is None or expires_at > ttl_expiry:
+            expires_at = ttl_expiry
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Caches youtube-dl results: search term -> video, video -> metadata and video -> stream URL.
+class MetadataCache:
+    def __init__(self, max_entries=5000, metadata_ttl=86400, search_ttl=3600, stream_url_ttl=1800, path=None):
+        self.searches = TTLCache(max_entries, search_ttl)
+        self.metadata = TTLCache(max_entries, metadata_ttl)
+        self.streams = TTLCache(max_entries, stream_url_ttl)
+        self.path = path
+
+    # Returns a stable key for a source: the video id for YouTube links, the URL without its scheme
+    # for other links and the lower cased query for searches.
+    @staticmethod
+    def normalize(source):
+        source = source.strip().strip('<>')
+        parsed = urlparse(source)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            return 'search:' + ' '.join(source.lower().split())
+
+        host = parsed.netloc.lower()
+        if host.startswith('www.') or host.startswith('m.'):
+            host = host.split('.', 1)[1]
+        if host == 'youtu.be' and len(parsed.path) > 1:
+            return 'youtube:' + parsed.path[1:].split('/')[0]
+        if host in ('youtube.com', 'music.youtube.com'):
+            video_id = parse_qs(parsed.query).get('v')
+            if video_id:
+                return 'youtube:' + video_id[0]
+        key = host + parsed.path.rstrip('/')
+        if parsed.query:
+            key += '?' + parsed.query
+        return key
+
+    # Returns the extractor backend of a normalized key, e.g. youtube or soundcloud.com.
+    @staticmethod
+    def backend(key):
+        if key.startswith('youtube:') or MetadataCache.is_search(key):
+            # Searches go to YouTube through default_search.
+            return 'youtube'
+        return key.split('/', 1)[0]
+
+    # Returns True if the source is a search term rather than a link.
+    @staticmethod
+    def is_search(key):
+        return key.startswith('search:')
+
+    # Returns the key of the video the source points to, following cached search results.
+    def video_key(self, source):
+        key = MetadataCache.normalize(source)
+        if MetadataCache.is_search(key):
+            return self.searches.get(key)
+        return key
+
+    # Returns the cached metadata dict for the source, or None.
+    def get_metadata(self, source):
+        key = self.video_key(source)
+        if key is None:
+            return None
+        return self.metadata.get(key)
+
+    # Returns the cached (stream_url, expires_at, formats) for the source, or None.
+    def get_stream(self, source):
+        key = self.video_key(source)
+        if key is None:
+            return None
+        return self.streams.get(key)
+
+    # Stores what is known about a resolved Track under the source it was requested with.
+    def store(self, source, track):
+        key = MetadataCache.normalize(track.url)
+        requested = MetadataCache.normalize(source)
+        if MetadataCache.is_search(requested):
+            self.searches.put(requested, key)
+        self.metadata.put(key, dict(url=track.url, title=track.title, uploader=track.uploader,
+                                    duration=track.duration))
+        if track.stream_url is not None:
+            expires_at = None
+            if track.expires_at is not None:
+                expires_at = track.expires_at - Track.STALE_MARGIN
+            self.streams.put(key, (track.stream_url, track.expires_at, track.formats), expires_at)
+
+    # Returns the hit and miss counters of each table.
+    def stats(self):
+        stats = {}
+        for name, table in (('search', self.searches), ('metadata', self.metadata), ('stream', self.streams)):
+            stats[name] = dict(hits=table.hits, misses=table.misses, size=len(table))
+        return stats
+
+    # Returns the cache contents in a form that can be written from another thread.
+    def snapshot(self):
+        return dict((name, list(table.entries.items()))
+                    for name, table in (('searches', self.searches), ('metadata', self.metadata),
+                                        ('streams', self.streams)))
+
+    # Writes a snapshot to the cache file.
+    def save(self, snapshot):
+        if self.path is None:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(snapshot, cache_file)
+        os.replace(temp_path, self.path)
+
+    # Loads the cache file if there is one, skipping entries that have expired since.
+    def load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        with open(self.path) as cache_file:
+            snapshot = json.load(cache_file)
+        now = time.time()
+        for name, table in (('searches', self.searches), ('metadata', self.metadata), ('streams', self.streams)):
+            for key, (value, expires_at) in snapshot.get(name, []):
+                if expires_at > now:
+                    if name == 'streams':
+                        # Files from before formats were cached hold (stream_url, expires_at).
+                        value = (value[0], value[1], value[2] if len(value) > 2 else [])
+                    table.entries[key] = (value, expires_at)
+            while len(table.entries) > table.max_entries:
+                table.entries.popitem(last=False)
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+from collections import deque
+
+
+# Counts of observations per bucket, plus the most recent observations for quantiles in the log summary.
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=1000)
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    # Returns the q quantile of the recent observations.
+    def quantile(self, q):
+        if len(self.recent) == 0:
+            return 0.0
+        recent = sorted(self.recent)
+        return recent[min(int(len(recent) * q), len(recent) - 1)]
+
+
+# Counters and histograms updated on the hot paths, plus gauges read when the metrics are collected.
+# Safe to update from player and executor threads.
+class Metrics:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, prefix='emusic'):
+        self.prefix = prefix
+        self.descriptions = {}  # name -> (type, help)
+        self.counters = {}  # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: Histogram}
+        self.collectors = []  # (name, function returning a value or {labels: value})
+        self.lock = threading.Lock()
+
+    # Labels are kept as sorted (name, value) tuples so they can be dict keys.
+    @staticmethod
+    def labels(labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def describe(self, name, metric_type, help_text):
+        self.descriptions[name] = (metric_type, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = Metrics.labels(labels)
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = Metrics.labels(labels)
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(Metrics.BUCKETS)
+                histograms[key] = histogram
+            histogram.observe(value)
+
+    # Registers a metric whose value is read from func when collected; func returns a number or
+    # {Metrics.labels(...): number}.
+    def collect(self, name, metric_type, help_text, func):
+        self.describe(name, metric_type, help_text)
+        self.collectors.append((name, func))
+
+    # Returns every metric in the Prometheus text format.
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = dict((name, dict(values)) for name, values in self.counters.items())
+            histograms = dict((name, dict((key, (list(h.counts), h.count, h.sum)) for key, h in values.items()))
+                              for name, values in self.histograms.items())
+
+        for name, values in sorted(counters.items()):
+            self.header(lines, name, 'counter')
+            for key, value in sorted(values.items()):
+                lines.append('{} {}'.format(self.series(name, key), value))
+
+        for name, values in sorted(histograms.items()):
+            self.header(lines, name, 'histogram')
+            for key, (counts, count, total) in sorted(values.items()):
+                for bound, bucket_count in zip(Metrics.BUCKETS, counts):
+                    lines.append('{} {}'.format(self.series(name + '_bucket', key + (('le', str(bound)),)),
+                                                bucket_count))
+                lines.append('{} {}'.format(self.series(name + '_bucket', key + (('le', '+Inf'),)), count))
+                lines.append('{} {}'.format(self.series(name + '_sum', key), total))
+                lines.append('{} {}'.format(self.series(name + '_count', key), count))
+
+        for name, func in self.collectors:
+            try:
+                value = func()
+            except Exception:
+                continue
+            self.header(lines, name, 'gauge')
+            if isinstance(value, dict):
+                for key, item in sorted(value.items()):
+                    lines.append('{} {}'.format(self.series(name, key), item))
+            else:
+                lines.append('{} {}'.format(self.series(name, ()), value))
+        return '\n'.join(lines) + '\n'
+
+    def header(self, lines, name, default_type):
+        metric_type, help_text = self.descriptions.get(name, (default_type, name))
+        full_name = '{}_{}'.format(self.prefix, name)
+        lines.append('# HELP {} {}'.format(full_name, help_text))
+        lines.append('# TYPE {} {}'.format(full_name, metric_type))
+
+    def series(self, name, key):
+        full_name = '{}_{}'.format(self.prefix, name)
+        if len(key) == 0:
+            return full_name
+        return '{}{{{}}}'.format(full_name, ','.join('{}="{}"'.format(
+            label, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for label, value in key))
+
+    # Returns one line per histogram with its count, mean, p50 and p99 over the recent observations.
+    def summary(self):
+        lines = []
+        with self.lock:
+            for name, values in sorted(self.histograms.items()):
+                for key, histogram in sorted(values.items()):
+                    if histogram.count == 0:
+                        continue
+                    lines.append('{}{} count={} avg={:.3f} p50={:.3f} p99={:.3f}'.format(
+                        name, ''.join('[{}={}]'.format(label, value) for label, value in key), histogram.count,
+                        histogram.sum / histogram.count, histogram.quantile(0.5), histogram.quantile(0.99)))
+        for name, func in self.collectors:
+            try:
+                value = func()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                value = ' '.join('{}={}'.format(','.join(v for _, v in key), item)
+                                 for key, item in sorted(value.items()))
+            lines.append('{} {}'.format(name, value))
+        return lines
+
+
+# Minimal HTTP server answering GET /metrics with Metrics.render().
+class MetricsServer:
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers.
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status = '200 OK'
+                body = self.metrics.render().encode('utf-8')
+            else:
+                status = '404 Not Found'
+                body = b'Not Found\n'
+            writer.write('HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                         'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(status, len(body))
+                         .encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
@@ -0,0 +1,70 @@
+import struct
+
+
+# Reads the Opus packets out of an Ogg stream, e.g. FFmpeg remuxing WebM audio with -c:a copy -f ogg.
+class OggOpusReader:
+    PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    # Yields every audio packet; the OpusHead and OpusTags header packets are skipped.
+    def packets(self):
+        partial = b''
+        while True:
+            header = self.read_exactly(OggOpusReader.PAGE_HEADER.size)
+            if header is None:
+                return
+            capture, version, header_type, granule, serial, sequence, checksum, segments = \
+                OggOpusReader.PAGE_HEADER.unpack(header)
+            if capture != b'OggS':
+                raise ValueError('Not an Ogg page.')
+            lacing = self.read_exactly(segments)
+            if lacing is None:
+                return
+            body = self.read_exactly(sum(lacing))
+            if body is None:
+                return
+
+            offset = 0
+            for size in lacing:
+                partial += body[offset:offset + size]
+                offset += size
+                # A lacing value below 255 ends the packet; 255 means it continues in the next segment.
+                if size < 255:
+                    packet = partial
+                    partial = b''
+                    if packet.startswith(b'OpusHead') or packet.startswith(b'OpusTags'):
+                        continue
+                    yield packet
+
+    # Returns the duration of an Opus packet in milliseconds, from its TOC byte.
+    @staticmethod
+    def packet_duration(packet):
+        if len(packet) == 0:
+            return 0
+        toc = packet[0]
+        config = toc >> 3
+        if config < 12:
+            frame = (10, 20, 40, 60)[config % 4]  # SILK
+        elif config < 16:
+            frame = (10, 20)[config % 2]  # Hybrid
+        else:
+            frame = (2.5, 5, 10, 20)[config % 4]  # CELT
+        count = toc & 3
+        if count == 0:
+            frames = 1
+        elif count < 3:
+            frames = 2
+        else:
+            frames = packet[1] & 0x3f if len(packet) > 1 else 0
+        return frame * frames
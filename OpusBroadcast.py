@@ -0,0 +1,239 @@
+import threading
+import subprocess
+from discord import opus
+from OggOpusReader import OggOpusReader
+
+
+# Decodes a track once with FFmpeg and encodes it once to Opus; any number of subscribers read the frames.
+# With passthrough, FFmpeg only remuxes Opus audio to Ogg and its packets are used as they are.
+class OpusBroadcast:
+    SAMPLING_RATE = 48000
+    CHANNELS = 2
+    FRAME_LENGTH = 20  # ms, what Discord expects per packet.
+    SAMPLES_PER_FRAME = SAMPLING_RATE // 1000 * FRAME_LENGTH
+    FRAME_SIZE = SAMPLES_PER_FRAME * CHANNELS * 2  # 16-bit PCM bytes per frame.
+
+    def __init__(self, key, args, retain_frames=3000, passthrough=False, fallback_args=None, max_ahead=1500):
+        self.key = key
+        self.args = args
+        self.retain_frames = retain_frames
+        # Frames FFmpeg may get ahead of the listeners before it is made to wait.
+        self.max_ahead = max_ahead
+        self.producer_waiting = False
+        self.passthrough = passthrough
+        # Decoding arguments to use if the passed through packets turn out not to be 20 ms.
+        self.fallback_args = fallback_args
+        self.dropped = 0
+        self.frames = []
+        self.base = 0  # Index of frames[0] in the whole stream.
+        self.finished = False
+        self.closed = False
+        self.listeners = 0
+        self.cursors = {}
+        self.condition = threading.Condition()
+        self.process = OpusBroadcast.start_process(args)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def start_process(args):
+        return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    # Produces the frames; runs on the broadcast's own thread.
+    def run(self):
+        try:
+            if not self.passthrough:
+                self.encode()
+            elif not self.copy_packets() and self.fallback_args is not None:
+                with self.condition:
+                    if self.closed:
+                        return
+                    self.stop_process()
+                    self.passthrough = False
+                    self.args = self.fallback_args
+                    self.process = OpusBroadcast.start_process(self.args)
+                self.encode()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    # Reads PCM from FFmpeg and appends the encoded frames.
+    def encode(self):
+        encoder = opus.Encoder(OpusBroadcast.SAMPLING_RATE, OpusBroadcast.CHANNELS)
+        while not self.closed:
+            pcm = self.process.stdout.read(OpusBroadcast.FRAME_SIZE)
+            if len(pcm) != OpusBroadcast.FRAME_SIZE:
+                break
+            self.append(encoder.encode(pcm, OpusBroadcast.SAMPLES_PER_FRAME))
+
+    # Appends the Opus packets FFmpeg remuxed to Ogg; returns False if the first packet is not 20 ms,
+    # as Discord expects, so the stream has to be encoded after all.
+    def copy_packets(self):
+        for packet in OggOpusReader(self.process.stdout).packets():
+            if self.closed:
+                break
+            if OggOpusReader.packet_duration(packet) != OpusBroadcast.FRAME_LENGTH:
+                if self.base == 0 and len(self.frames) == 0:
+                    return False
+                self.dropped += 1
+                continue
+            self.append(packet)
+        return True
+
+    # Appends a frame, first waiting while the broadcast is max_ahead frames ahead of its listeners.
+    def append(self, frame):
+        with self.condition:
+            while not self.closed and self.max_ahead and self.ahead() >= self.max_ahead:
+                self.producer_waiting = True
+                self.condition.wait()
+            self.producer_waiting = False
+            if self.closed:
+                return
+            self.frames.append(frame)
+            self.trim()
+            self.condition.notify_all()
+
+    def stop_process(self):
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+    # Returns how many frames the broadcast has beyond its furthest listener; must hold the condition.
+    # The furthest rather than the slowest, so a paused server does not stall the others playing the track.
+    def ahead(self):
+        return self.base + len(self.frames) - max(self.cursors.values(), default=self.base)
+
+    # Drops frames that every listener is more than retain_frames past; must hold the condition.
+    # Until then a new listener can still join from the first frame.
+    def trim(self):
+        if len(self.cursors) == 0:
+            return
+        drop = min(self.cursors.values()) - self.base - self.retain_frames
+        if drop > 0:
+            del self.frames[:drop]
+            self.base += drop
+
+    # Adds a listener and returns its id; returns None if a new listener can no longer start from the first
+    # frame. Checked under the condition, as the producer trims the frames without the broadcaster's lock.
+    def subscribe(self):
+        with self.condition:
+            if self.closed or self.base != 0:
+                return None
+            self.listeners += 1
+            listener = self.listeners
+            self.cursors[listener] = 0
+            return listener
+
+    # Removes a listener; returns True if it was the last one.
+    def unsubscribe(self, listener):
+        with self.condition:
+            self.cursors.pop(listener, None)
+            # Wakes the listener if it is waiting in read().
+            self.condition.notify_all()
+            return len(self.cursors) == 0
+
+    # Returns the listener's next frame, waiting for it to be encoded; None at the end of the track.
+    def read(self, listener, timeout=None):
+        with self.condition:
+            while True:
+                cursor = self.cursors.get(listener)
+                if cursor is None:
+                    return None
+                if cursor - self.base < len(self.frames):
+                    frame = self.frames[cursor - self.base]
+                    self.cursors[listener] = cursor + 1
+                    if self.producer_waiting:
+                        self.condition.notify_all()
+                    if self.finished and cursor % 50 == 0:
+                        self.trim()
+                    return frame
+                if self.finished:
+                    return None
+                if not self.condition.wait(timeout):
+                    return b''
+
+    # Stops FFmpeg and releases the frames.
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.frames = []
+            self.condition.notify_all()
+            process = self.process
+        try:
+            process.kill()
+            process.wait()
+        except OSError:
+            pass
+
+
+# Shares one OpusBroadcast per unique track and start offset between every server playing it.
+class OpusBroadcaster:
+    def __init__(self, executable='ffmpeg', retain_frames=3000, max_ahead=1500):
+        self.executable = executable
+        self.retain_frames = retain_frames
+        self.max_ahead = max_ahead
+        self.broadcasts = {}
+        self.lock = threading.Lock()
+        self.started = 0
+        self.shared = 0
+        self.passthrough = 0
+
+    # Returns (broadcast, listener) for the track, starting a broadcast if there is no joinable one.
+    # With passthrough the source must be Opus audio, whose packets are sent without decoding them.
+    def subscribe(self, key, source, offset=0, before_options=None, passthrough=False):
+        broadcast_key = (key, offset, passthrough)
+        with self.lock:
+            broadcast = self.broadcasts.get(broadcast_key)
+            listener = None if broadcast is None else broadcast.subscribe()
+            if listener is not None:
+                self.shared += 1
+            else:
+                args = self.ffmpeg_args(source, offset, before_options)
+                if passthrough:
+                    broadcast = OpusBroadcast(broadcast_key, self.ffmpeg_args(source, offset, before_options, True),
+                                              retain_frames=self.retain_frames, passthrough=True,
+                                              fallback_args=args, max_ahead=self.max_ahead)
+                    self.passthrough += 1
+                else:
+                    broadcast = OpusBroadcast(broadcast_key, args, retain_frames=self.retain_frames,
+                                              max_ahead=self.max_ahead)
+                self.broadcasts[broadcast_key] = broadcast
+                self.started += 1
+                listener = broadcast.subscribe()
+            return broadcast, listener
+
+    # Removes a listener; the broadcast is torn down when the last one leaves.
+    def unsubscribe(self, broadcast, listener):
+        with self.lock:
+            if not broadcast.unsubscribe(listener):
+                return
+            if self.broadcasts.get(broadcast.key) is broadcast:
+                del self.broadcasts[broadcast.key]
+        broadcast.close()
+
+    def ffmpeg_args(self, source, offset, before_options, passthrough=False):
+        args = [self.executable, '-nostdin', '-loglevel', 'error']
+        if before_options is not None:
+            args.extend(before_options)
+        if offset > 0:
+            args.extend(['-ss', str(offset)])
+        if passthrough:
+            args.extend(['-i', source, '-vn', '-c:a', 'copy', '-f', 'ogg', 'pipe:1'])
+        else:
+            args.extend(['-i', source, '-vn', '-f', 's16le', '-ar', str(OpusBroadcast.SAMPLING_RATE),
+                         '-ac', str(OpusBroadcast.CHANNELS), 'pipe:1'])
+        return args
+
+    # Returns how many broadcasts are running and how often one was shared instead of started.
+    def stats(self):
+        with self.lock:
+            listeners = sum(len(broadcast.cursors) for broadcast in self.broadcasts.values())
+            return dict(active=len(self.broadcasts), started=self.started, shared=self.shared,
+                        passthrough=self.passthrough, listeners=listeners)
@@ -1,32 +1,68 @@
-import _thread
-import youtube_dl
+import asyncio
+from collections import deque
+from Track import Track
+from Extraction import iterate_playlist, list_playlist
+from ExtractionScheduler import ExtractionScheduler
 
 
+# Streams the entries of a playlist into an asyncio.Queue as they are enumerated.
 class PlayerPlaylist:
-    def __init__(self, channel, voice_client, source):
+    def __init__(self, channel, voice_client, source, loop, scheduler):
         self.channel = channel
         self.voice_client = voice_client
         self.source = source
-        self.urls = []
-        self.completed = False
-        self.youtube_dl_options = dict(
-            ignoreerrors=True,
-            noplaylist=False,
-            default_search="auto",
-            quiet=True,
-            nocheckcertificate=True,
-            abortonerror=False
-        )
-        try:
-            _thread.start_new_thread(self.download_playlist_info, ())
-        except Exception as e:
-            print(e)
-            pass
+        self.loop = loop
+        self.tracks = asyncio.Queue()
+        self.total = None
+        self.resolutions = deque()  # (track, resolution task) in playlist order, kept by the consumer
+        self.cancelled = False
 
+        server_id = voice_client.server.id
+        if scheduler.streams():
+            self.future = scheduler.submit(server_id, ExtractionScheduler.BULK, self.download_playlist_info,
+                                           in_thread=True)
+        else:
+            # Process workers cannot call back into the loop, so the flat entries come back all at once.
+            self.future = scheduler.submit(server_id, ExtractionScheduler.BULK, list_playlist, source)
+        self.future.add_done_callback(self.enumerated)
+
+    # Enumerates the playlist without resolving each video's page; runs on a scheduler thread.
     def download_playlist_info(self):
-        with youtube_dl.YoutubeDL(self.youtube_dl_options) as ytdl:
-            ytdl_playlist = ytdl.extract_info(self.source, download=False)
-        for video in ytdl_playlist['entries']:
-            if video is not None:
-                self.urls.append(video['webpage_url'])
-        self.completed = True
+        for total, video in iterate_playlist(self.source):
+            if self.cancelled:
+                break
+            self.loop.call_soon_threadsafe(self.put, total, video)
+
+    # Turns a flat entry into a Track and hands it to the consumer; entries without a URL are skipped.
+    def put(self, total, video):
+        self.total = total
+        url = PlayerPlaylist.entry_url(video)
+        if url is None:
+            return
+        track = Track(url)
+        track.update(video)
+        self.tracks.put_nowait(track)
+
+    # Marks the enumeration as done; None tells the consumer there are no more tracks.
+    def enumerated(self, future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            for total, video in future.result():
+                self.put(total, video)
+        self.tracks.put_nowait(None)
+
+    # Stops enumerating and queueing any further tracks.
+    def cancel(self):
+        self.cancelled = True
+        self.future.cancel()
+        for track, resolution in self.resolutions:
+            resolution.cancel()
+
+    # Returns a playable URL for a flat playlist entry, or None if it has none.
+    @staticmethod
+    def entry_url(video):
+        url = video.get('webpage_url') or video.get('url')
+        if url is None:
+            return None
+        if video.get('ie_key') == 'Youtube' and not url.startswith('http'):
+            url = 'https://www.youtube.com/watch?v={}'.format(url)
+        return url
@@ -0,0 +1,158 @@
+import os
+import json
+import threading
+
+
+# Append-only log of every server's queue and now playing track, so both survive a restart.
+# Queue changes are recorded as small operations and replayed on load; once the log has grown well past
+# what it describes it is rewritten from a snapshot of the current state.
+class QueueStore:
+    def __init__(self, path, compact_after=10000):
+        self.path = path
+        self.compact_after = compact_after
+        self.pending = []  # Encoded records not written yet.
+        self.logged = 0  # Records in the file since it was last rewritten.
+        self.lock = threading.Lock()  # Serializes writes to the file.
+        self.written = 0
+        self.compactions = 0
+
+    # Returns the metadata of the Track that is stored for it.
+    @staticmethod
+    def track_record(track):
+        return dict(source=track.source, url=track.url, title=track.title, uploader=track.uploader,
+                    duration=track.duration)
+
+    # Records one change of the server's state; the arguments must be JSON serializable.
+    def record(self, server_id, op, *args):
+        self.pending.append(json.dumps([server_id, op] + list(args)))
+
+    # Records a change of the server's TrackQueue; used as its journal.
+    def record_queue(self, server_id, op, *args):
+        if op == 'append':
+            args = (QueueStore.track_record(args[0]),)
+        self.record(server_id, op, *args)
+
+    # Records the track the server is playing, the voice channel it plays in and the position in seconds.
+    def record_current(self, server_id, track, channel_id, position=0):
+        if track is None:
+            self.record(server_id, 'current', None, channel_id, 0)
+        else:
+            self.record(server_id, 'current', QueueStore.track_record(track), channel_id, position)
+
+    def record_position(self, server_id, position):
+        self.record(server_id, 'position', position)
+
+    def record_drop(self, server_id):
+        self.record(server_id, 'drop')
+
+    # Returns True once the log holds enough records that rewriting it is worthwhile.
+    def needs_compaction(self):
+        return self.logged + len(self.pending) > self.compact_after
+
+    # Takes the records that are waiting to be written; called on the event loop.
+    def take_pending(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    # Appends records to the log; runs in an executor.
+    def write(self, records):
+        if len(records) == 0:
+            return
+        with self.lock:
+            with open(self.path, 'a') as log_file:
+                log_file.write('\n'.join(records) + '\n')
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            self.logged += len(records)
+            self.written += len(records)
+
+    # Replaces the log with the given states; runs in an executor.
+    # The snapshot must already contain every record that was pending when it was taken.
+    def compact(self, states):
+        records = []
+        for server_id, state in states.items():
+            records.append(json.dumps([server_id, 'current', state['current'], state['channel'], state['position']]))
+            for track in state['queue']:
+                records.append(json.dumps([server_id, 'append', track]))
+        with self.lock:
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as log_file:
+                if len(records) > 0:
+                    log_file.write('\n'.join(records) + '\n')
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            os.replace(temp_path, self.path)
+            self.logged = len(records)
+            self.compactions += 1
+
+    # Returns a snapshot of the server's state in the form compact() and load() use.
+    @staticmethod
+    def state(track, channel_id, position, queued_tracks):
+        return dict(current=None if track is None else QueueStore.track_record(track), channel=channel_id,
+                    position=position, queue=[QueueStore.track_record(t) for t in queued_tracks])
+
+    # Replays the log and returns {server id: state}; servers with nothing playing or queued are left out.
+    def load(self):
+        states = {}
+        if not os.path.isfile(self.path):
+            return states
+        logged = 0
+        torn = None  # The last line, if a crash cut it short.
+        unterminated = False  # Whether the last line is a whole record without its newline.
+        with open(self.path) as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by the crash; everything before it is still good.
+                    if not line.endswith('\n'):
+                        torn = line
+                    continue
+                logged += 1
+                unterminated = not line.endswith('\n')
+                server_id, op, args = record[0], record[1], record[2:]
+                if op == 'drop':
+                    states.pop(server_id, None)
+                    continue
+                state = states.get(server_id)
+                if state is None:
+                    state = dict(current=None, channel=None, position=0, queue=[])
+                    states[server_id] = state
+                queue = state['queue']
+                try:
+                    if op == 'append':
+                        queue.append(args[0])
+                    elif op == 'advance':
+                        if len(queue) > 0:
+                            del queue[0]
+                    elif op == 'remove':
+                        del queue[args[0]]
+                    elif op == 'pop':
+                        queue.pop()
+                    elif op == 'move':
+                        track = queue.pop(args[0])
+                        queue.insert(min(max(args[1], 0), len(queue)), track)
+                    elif op == 'clear':
+                        del queue[:]
+                    elif op == 'current':
+                        state['current'], state['channel'], state['position'] = args
+                    elif op == 'position':
+                        state['position'] = args[0]
+                except IndexError:
+                    continue
+        if torn is not None:
+            # Cut off, as the next write would otherwise continue the line and its first record would be lost
+            # along with it on the next load.
+            os.truncate(self.path, os.path.getsize(self.path) - len(torn))
+        elif unterminated:
+            with open(self.path, 'a') as log_file:
+                log_file.write('\n')
+        self.logged = logged
+        return dict((server_id, state) for server_id, state in states.items()
+                    if state['current'] is not None or len(state['queue']) > 0)
+
+    # Returns the write counters.
+    def stats(self):
+        return dict(pending=len(self.pending), logged=self.logged, written=self.written,
+                    compactions=self.compactions)
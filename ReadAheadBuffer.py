@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+
+
+# Frames read ahead of a player on a thread of their own, so a stall of FFmpeg's input or a busy interpreter
+# does not stop the audio right away. The buffer grows when it runs dry and shrinks again once playback has
+# been smooth for a while, keeping memory per server low where the link is stable.
+class ReadAheadBuffer:
+    def __init__(self, read_frame, min_frames=25, max_frames=500, stable_frames=3000, on_underrun=None):
+        self.read_frame = read_frame  # Returns the next frame; None or an empty frame at the end of the stream.
+        self.min_frames = min_frames
+        self.max_frames = max(min_frames, max_frames)
+        self.stable_frames = stable_frames
+        self.on_underrun = on_underrun
+        self.capacity = min(self.max_frames, min_frames * 2)
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.finished = False
+        self.closed = False
+        self.delivered = 0
+        self.underruns = 0
+        self.smooth = 0  # Frames delivered since the last underrun or resize.
+        self.thread = threading.Thread(target=self.run, name='ReadAheadBuffer', daemon=True)
+        self.thread.start()
+
+    # Fills the buffer up to its capacity; runs on the buffer's own thread.
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while not self.closed and len(self.frames) >= self.capacity:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                frame = self.read_frame()
+                if not frame:
+                    return
+                with self.condition:
+                    self.frames.append(frame)
+                    self.condition.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    # Returns the next frame, or b'' once the stream has ended or the buffer was closed.
+    # size is ignored; it is there so the buffer can stand in for a player's stream.
+    def read(self, size=None):
+        underrun = False
+        with self.condition:
+            if len(self.frames) == 0 and not self.finished and not self.closed and self.delivered > 0:
+                underrun = True
+                self.underruns += 1
+                self.smooth = 0
+                self.capacity = min(self.max_frames, self.capacity * 2)
+                self.condition.notify_all()
+                # Refill a little before going on, rather than stuttering frame by frame.
+                while len(self.frames) < self.min_frames and not self.finished and not self.closed:
+                    self.condition.wait()
+            while len(self.frames) == 0 and not self.finished and not self.closed:
+                self.condition.wait()
+            if len(self.frames) == 0:
+                return b''
+            frame = self.frames.popleft()
+            self.delivered += 1
+            self.smooth += 1
+            if self.smooth >= self.stable_frames and self.capacity > self.min_frames:
+                self.capacity = max(self.min_frames, self.capacity // 2)
+                self.smooth = 0
+            self.condition.notify_all()
+        if underrun and self.on_underrun is not None:
+            self.on_underrun()
+        return frame
+
+    # Stops reading ahead and releases the frames.
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.frames.clear()
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return dict(fill=len(self.frames), capacity=self.capacity, underruns=self.underruns)
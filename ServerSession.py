@@ -0,0 +1,38 @@
+import time
+import asyncio
+from TrackQueue import TrackQueue
+
+
+# Everything the bot keeps for one server: the current player, the queue and pending playlists.
+class ServerSession:
+    __slots__ = ('server_id', 'player', 'track', 'queue', 'queue_embeds', 'playlists', 'lock', 'last_active',
+                 'paused_at', 'suspended_position', 'empty_since')
+
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.player = None
+        self.track = None
+        self.queue = TrackQueue()
+        # (queue version, {page end: embed}) of rendered queue pages.
+        self.queue_embeds = (-1, {})
+        self.playlists = []
+        # Serializes starting tracks for the server.
+        self.lock = asyncio.Lock()
+        self.last_active = time.time()
+        # When the player was paused, or None while it is not.
+        self.paused_at = None
+        # Seconds into the track at which a suspended player stopped; see is_suspended().
+        self.suspended_position = 0
+        # When the bot's voice channel was last seen without listeners, or None.
+        self.empty_since = None
+
+    def touch(self):
+        self.last_active = time.time()
+
+    # Returns True if nothing is playing, suspended, queued or being queued.
+    def is_idle(self):
+        return self.player is None and self.track is None and len(self.queue) == 0 and len(self.playlists) == 0
+
+    # Returns True if the player was stopped to free its resources but its Track is kept to resume later.
+    def is_suspended(self):
+        return self.player is None and self.track is not None
@@ -0,0 +1,149 @@
+import sys
+import time
+import signal
+import asyncio
+from collections import OrderedDict
+from Metrics import MetricsServer
+
+
+# Runs one bot process per shard, restarts shards that exit and serves their metrics as one endpoint.
+class ShardSupervisor:
+    def __init__(self, script, shard_count, metrics_host='127.0.0.1', metrics_port=None, restart_delay=1,
+                 max_restart_delay=60, scrape_interval=5):
+        self.script = script
+        self.shard_count = shard_count
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.scrape_interval = scrape_interval
+        self.processes = {}  # shard id -> running process
+        self.restarts = dict((shard_id, 0) for shard_id in range(shard_count))
+        self.scraped = {}  # shard id -> metrics text of the shard
+        self.stopping = False
+        self.loop = None
+
+    # Returns the port a shard serves its own metrics on.
+    @staticmethod
+    def shard_metrics_port(metrics_port, shard_id):
+        return metrics_port + 1 + shard_id
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signal_number, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not available on Windows; Ctrl+C still reaches the shards there.
+                pass
+        tasks = [self.loop.create_task(self.watch(shard_id)) for shard_id in range(self.shard_count)]
+        server = None
+        if self.metrics_port is not None:
+            server = MetricsServer(self, host=self.metrics_host, port=self.metrics_port)
+            self.loop.run_until_complete(server.start())
+            tasks.append(self.loop.create_task(self.scrape()))
+        try:
+            self.loop.run_until_complete(asyncio.gather(*tasks))
+        except KeyboardInterrupt:
+            self.stop()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            if server is not None:
+                server.close()
+            self.loop.close()
+
+    # Asks every shard to exit and stops restarting them.
+    def stop(self):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+
+    # Keeps the shard running; a shard that keeps crashing right after starting is restarted less often.
+    async def watch(self, shard_id):
+        delay = self.restart_delay
+        while not self.stopping:
+            started = time.time()
+            process = await asyncio.create_subprocess_exec(sys.executable, self.script, '--shard', str(shard_id))
+            self.processes[shard_id] = process
+            code = await process.wait()
+            del self.processes[shard_id]
+            self.scraped.pop(shard_id, None)
+            if self.stopping:
+                break
+            print('Shard {} exited with code {}; restarting in {}s.'.format(shard_id, code, delay))
+            self.restarts[shard_id] += 1
+            await asyncio.sleep(delay)
+            if time.time() - started > self.max_restart_delay:
+                delay = self.restart_delay
+            else:
+                delay = min(delay * 2, self.max_restart_delay)
+
+    # Periodically fetches every running shard's metrics.
+    async def scrape(self):
+        while not self.stopping:
+            for shard_id in list(self.processes):
+                try:
+                    self.scraped[shard_id] = await asyncio.wait_for(self.fetch(shard_id), self.scrape_interval)
+                except (OSError, asyncio.TimeoutError):
+                    self.scraped.pop(shard_id, None)
+            await asyncio.sleep(self.scrape_interval)
+
+    async def fetch(self, shard_id):
+        reader, writer = await asyncio.open_connection(
+            self.metrics_host, ShardSupervisor.shard_metrics_port(self.metrics_port, shard_id))
+        try:
+            writer.write(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        if not head.startswith(b'HTTP/1.0 200'):
+            raise OSError('Shard {} answered: {}'.format(shard_id, head.split(b'\r\n')[0]))
+        return body.decode('utf-8')
+
+    # Returns the metrics of every shard with a shard label, plus the supervisor's own, in the Prometheus
+    # text format; each metric is described once.
+    def render(self):
+        families = OrderedDict()  # name -> [help line, type line, samples]
+        families['emusic_shard_up'] = ['# HELP emusic_shard_up Whether the shard process is running.',
+                                       '# TYPE emusic_shard_up gauge', []]
+        families['emusic_shard_restarts_total'] = [
+            '# HELP emusic_shard_restarts_total Times the shard was restarted.',
+            '# TYPE emusic_shard_restarts_total counter', []]
+        for shard_id in range(self.shard_count):
+            families['emusic_shard_up'][2].append('emusic_shard_up{{shard="{}"}} {}'.format(
+                shard_id, int(shard_id in self.processes)))
+            families['emusic_shard_restarts_total'][2].append('emusic_shard_restarts_total{{shard="{}"}} {}'.format(
+                shard_id, self.restarts[shard_id]))
+
+        for shard_id, text in sorted(self.scraped.items()):
+            family = None
+            for line in text.splitlines():
+                if line.startswith('# '):
+                    parts = line.split(' ', 3)
+                    if len(parts) < 3:
+                        continue
+                    family = families.setdefault(parts[2], [None, None, []])
+                    if parts[1] == 'HELP' and family[0] is None:
+                        family[0] = line
+                    elif parts[1] == 'TYPE' and family[1] is None:
+                        family[1] = line
+                elif line and family is not None:
+                    family[2].append(ShardSupervisor.label(line, shard_id))
+
+        lines = []
+        for help_line, type_line, samples in families.values():
+            lines.extend(line for line in (help_line, type_line) if line is not None)
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    # Adds the shard label to a sample line.
+    @staticmethod
+    def label(line, shard_id):
+        name, _, rest = line.partition(' ')
+        if '{' in name:
+            name, _, labels = line.partition('{')
+            return '{}{{shard="{}",{}'.format(name, shard_id, labels)
+        return '{}{{shard="{}"}} {}'.format(name, shard_id, rest)
@@ -0,0 +1,41 @@
+import asyncio
+import functools
+
+
+# Runs one call at a time per key; callers asking for a key that is already in flight await the same result,
+# including its exception.
+class SingleFlight:
+    def __init__(self, loop):
+        self.loop = loop
+        self.flights = {}  # key -> task of the call in flight
+        self.started = 0
+        self.deduplicated = 0
+
+    # Returns the result of func(*args), or of the call already in flight for the key.
+    # If that call is cancelled, retry() tells whether this caller still wants a result; otherwise it gets the
+    # CancelledError too.
+    async def do(self, key, func, *args, retry=None):
+        while True:
+            task = self.flights.get(key)
+            if task is None:
+                task = self.loop.create_task(func(*args))
+                self.flights[key] = task
+                task.add_done_callback(functools.partial(self.landed, key))
+                self.started += 1
+            else:
+                self.deduplicated += 1
+            try:
+                # Shielded so a caller that gives up does not cancel the call for the others.
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled() or retry is None or not retry():
+                    raise
+                # The call itself was cancelled, e.g. with the jobs of the server that started it; try again
+                # on behalf of this caller.
+
+    def landed(self, key, task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+
+    def stats(self):
+        return dict(in_flight=len(self.flights), started=self.started, deduplicated=self.deduplicated)
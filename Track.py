@@ -0,0 +1,112 @@
+import time
+from urllib.parse import urlparse, parse_qs
+
+
+# Lightweight descriptor for a queued song; the real player is only built when it is about to play.
+class Track:
+    # Seconds before the stream URL's expiry at which it is already treated as stale.
+    STALE_MARGIN = 60
+
+    def __init__(self, source, url=None, title=None, uploader=None, duration=None):
+        self.source = source
+        self.url = url if url is not None else source
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.stream_url = None
+        self.resolved_at = None
+        self.expires_at = None
+        # Audio-only formats as (kbps, codec, format id, url), sharing the stream URL's expiry.
+        self.formats = []
+        # Maintained by TrackQueue for its running totals.
+        self.in_queue = False
+        self.queued_duration = None
+
+    # Builds a Track from a youtube-dl info dict.
+    @classmethod
+    def from_info(cls, source, info, stream_url_ttl=None):
+        track = cls(source)
+        if not track.update(info, stream_url_ttl):
+            return None
+        return track
+
+    # Fills in the metadata and stream URL from a youtube-dl info dict; returns False if it has no entries.
+    def update(self, info, stream_url_ttl=None):
+        if 'entries' in info:
+            # Search results come back as a playlist; use the first hit.
+            entries = [entry for entry in info['entries'] if entry is not None]
+            if len(entries) == 0:
+                return False
+            info = entries[0]
+
+        duration = info.get('duration')
+        if duration is not None:
+            duration = int(duration)
+
+        self.url = info.get('webpage_url') or self.url
+        self.title = info.get('title') or self.title
+        self.uploader = info.get('uploader') or self.uploader
+        if duration is not None:
+            self.duration = duration
+
+        # Flat playlist entries only carry a page URL, not a playable stream.
+        if info.get('_type', 'video') == 'video' and info.get('url') is not None:
+            self.set_stream_url(info['url'], stream_url_ttl, formats=Track.audio_formats(info))
+        return True
+
+    # Returns the audio-only formats of a youtube-dl info dict that have a known bitrate.
+    @staticmethod
+    def audio_formats(info):
+        formats = []
+        for f in info.get('formats') or ():
+            bitrate = f.get('abr') or f.get('tbr')
+            if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none') and f.get('url') and bitrate:
+                formats.append((bitrate, f['acodec'], f.get('format_id'), f['url']))
+        return formats
+
+    # Returns the smallest audio-only format of at least kbps, or the largest if none is; None if there are none.
+    # Among formats that are large enough, Opus ones come first if prefer_opus is set.
+    def select_format(self, kbps, prefer_opus=False):
+        if len(self.formats) == 0:
+            return None
+        adequate = [f for f in self.formats if f[0] >= kbps]
+        if len(adequate) == 0:
+            return max(self.formats, key=lambda f: f[0])
+        if prefer_opus:
+            return min(adequate, key=lambda f: (f[1] != 'opus', f[0]))
+        return min(adequate, key=lambda f: f[0])
+
+    # Builds a Track from metadata cached by a previous resolution.
+    @classmethod
+    def from_metadata(cls, source, metadata):
+        return cls(source, url=metadata['url'], title=metadata['title'], uploader=metadata['uploader'],
+                   duration=metadata['duration'])
+
+    # Records a resolved stream URL and its alternative formats along with when they stop being usable.
+    def set_stream_url(self, stream_url, stream_url_ttl=None, expires_at=None, formats=None):
+        self.stream_url = stream_url
+        self.formats = [tuple(f) for f in formats] if formats is not None else []
+        self.resolved_at = time.time()
+        self.expires_at = expires_at
+        if stream_url is None or expires_at is not None:
+            return
+
+        # YouTube stream URLs carry their own expiry timestamp.
+        expire = parse_qs(urlparse(stream_url).query).get('expire')
+        if expire:
+            try:
+                self.expires_at = float(expire[0])
+            except ValueError:
+                pass
+        if self.expires_at is None and stream_url_ttl is not None:
+            self.expires_at = self.resolved_at + stream_url_ttl
+
+    # Returns True if there is no stream URL or it is about to expire.
+    def is_stale(self, now=None):
+        if self.stream_url is None:
+            return True
+        if self.expires_at is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now >= self.expires_at - Track.STALE_MARGIN
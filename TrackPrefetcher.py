@@ -0,0 +1,79 @@
+import time
+import asyncio
+from ExtractionScheduler import ExtractionScheduler
+
+
+# Resolves the next tracks of each server's queue in the background so the handoff between songs is cheap.
+class TrackPrefetcher:
+    def __init__(self, loop, resolve, get_upcoming, count=2, lead_time=30):
+        self.loop = loop
+        self.resolve = resolve  # Coroutine function (server_id, track, priority) that refreshes a Track in place.
+        self.get_upcoming = get_upcoming  # Returns the next count queued Tracks of a server id.
+        self.count = count
+        self.lead_time = lead_time
+        self.timers = {}
+        self.windows = {}
+        self.tasks = {}  # (server id, id of the Track) -> resolution task
+
+    # Called when a track starts; opens the prefetch window lead_time seconds before it ends.
+    def track_started(self, server_id, duration):
+        self.cancel(server_id)
+        delay = 0
+        if duration is not None:
+            delay = max(0, duration - self.lead_time)
+        self.windows[server_id] = time.time() + delay
+        self.timers[server_id] = self.loop.call_later(delay, self.prefetch, server_id)
+
+    # Called when the queue changes; prefetches right away if the window is already open.
+    def queue_changed(self, server_id):
+        window = self.windows.get(server_id)
+        if window is not None and time.time() >= window:
+            self.prefetch(server_id)
+
+    # Starts resolving the next tracks of the server's queue that are unresolved or stale.
+    def prefetch(self, server_id):
+        self.timers.pop(server_id, None)
+        for track in self.get_upcoming(server_id, self.count):
+            if track.is_stale():
+                self.ensure_resolving(server_id, track, ExtractionScheduler.PREFETCH)
+
+    # Returns the pending resolution for the Track, starting one if needed.
+    def ensure_resolving(self, server_id, track, priority):
+        key = (server_id, id(track))
+        task = self.tasks.get(key)
+        if task is None or task.done():
+            task = self.loop.create_task(self.resolve(server_id, track, priority))
+            self.tasks[key] = task
+            task.add_done_callback(lambda t: self.forget(key, t))
+        return task
+
+    def forget(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+
+    # Makes sure the Track has a fresh stream URL, reusing an in-flight prefetch if there is one.
+    async def ready(self, server_id, track):
+        task = self.tasks.get((server_id, id(track)))
+        if task is not None and not task.done():
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # Only the prefetch was cancelled; resolve the track for this caller below.
+                if not task.cancelled():
+                    raise
+        if track.is_stale():
+            await self.ensure_resolving(server_id, track, ExtractionScheduler.INTERACTIVE)
+
+    # Stops any scheduled prefetch for the server.
+    def cancel(self, server_id):
+        timer = self.timers.pop(server_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.windows.pop(server_id, None)
+
+    # Stops any scheduled prefetch for the server and cancels its resolutions in progress.
+    def stop(self, server_id):
+        self.cancel(server_id)
+        for (task_server_id, track_id), task in list(self.tasks.items()):
+            if task_server_id == server_id:
+                task.cancel()
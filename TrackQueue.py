@@ -0,0 +1,118 @@
+from collections import deque
+from itertools import islice
+
+
+# Queue of Tracks backed by a deque so advancing is O(1) and positional edits stay cheap on long queues.
+# Keeps running totals so the queue command never has to walk every entry.
+class TrackQueue:
+    __slots__ = ('tracks', 'total_duration', 'unknown_durations', 'version', 'journal')
+
+    def __init__(self, tracks=()):
+        self.tracks = deque()
+        self.total_duration = 0
+        self.unknown_durations = 0
+        # Bumped on every change so rendered pages can be cached.
+        self.version = 0
+        # Optional callable(op, *args) told about every change, e.g. to persist the queue.
+        self.journal = None
+        for track in tracks:
+            self.append(track)
+
+    # Adds the Track's duration to the totals and remembers what was counted for it.
+    def count(self, track):
+        track.in_queue = True
+        track.queued_duration = track.duration
+        if track.duration is None:
+            self.unknown_durations += 1
+        else:
+            self.total_duration += track.duration
+
+    # Takes the Track back out of the totals.
+    def uncount(self, track):
+        if track.queued_duration is None:
+            self.unknown_durations -= 1
+        else:
+            self.total_duration -= track.queued_duration
+        track.in_queue = False
+        track.queued_duration = None
+
+    def changed(self, op, *args):
+        self.version += 1
+        if self.journal is not None:
+            self.journal(op, *args)
+
+    def append(self, track):
+        self.tracks.append(track)
+        self.count(track)
+        self.changed('append', track)
+
+    # Removes and returns the next Track; None if the queue is empty.
+    def advance(self):
+        if len(self.tracks) == 0:
+            return None
+        track = self.tracks.popleft()
+        self.uncount(track)
+        self.changed('advance')
+        return track
+
+    # Removes and returns the Track at the 0-based index; raises IndexError if there is none.
+    def remove(self, index):
+        if index < 0 or index >= len(self.tracks):
+            raise IndexError(index)
+        track = self.tracks[index]
+        del self.tracks[index]
+        self.uncount(track)
+        self.changed('remove', index)
+        return track
+
+    # Removes and returns the last Track.
+    def pop(self):
+        track = self.tracks.pop()
+        self.uncount(track)
+        self.changed('pop')
+        return track
+
+    # Moves the Track at the 0-based source index to the destination index and returns it.
+    def move(self, source, destination):
+        if source < 0 or source >= len(self.tracks):
+            raise IndexError(source)
+        track = self.tracks[source]
+        del self.tracks[source]
+        self.tracks.insert(min(max(destination, 0), len(self.tracks)), track)
+        self.changed('move', source, destination)
+        return track
+
+    def clear(self):
+        for track in self.tracks:
+            track.in_queue = False
+            track.queued_duration = None
+        self.tracks.clear()
+        self.total_duration = 0
+        self.unknown_durations = 0
+        self.changed('clear')
+
+    # Called when a queued Track's metadata was filled in after it was queued.
+    def track_updated(self, track):
+        if not track.in_queue:
+            return
+        if track.queued_duration != track.duration:
+            self.uncount(track)
+            self.count(track)
+        self.version += 1
+
+    # Returns the next count Tracks without removing them.
+    def peek(self, count):
+        return list(islice(self.tracks, count))
+
+    # Returns the Tracks from start to end; only those entries are touched.
+    def page(self, start, end):
+        return [self.tracks[i] for i in range(max(start, 0), min(end, len(self.tracks)))]
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __getitem__(self, index):
+        return self.tracks[index]
@@ -0,0 +1,66 @@
+# Keeps track of which voice channel every user is in, so lookups do not scan every server and channel.
+# Maintained from the voice state, channel and server events.
+class VoiceStateIndex:
+    def __init__(self):
+        self.channels = {}  # user id -> voice channel
+        self.members = {}  # voice channel id -> set of user ids
+
+    # Rebuilds the index from scratch, e.g. after (re)connecting.
+    def rebuild(self, servers):
+        self.channels = {}
+        self.members = {}
+        for server in servers:
+            self.add_server(server)
+
+    def add_server(self, server):
+        for channel in server.channels:
+            for member in channel.voice_members:
+                self.set_channel(member, channel)
+
+    def remove_server(self, server):
+        for channel in server.channels:
+            self.remove_channel(channel)
+
+    def remove_channel(self, channel):
+        for user_id in self.members.pop(channel.id, ()):
+            self.channels.pop(user_id, None)
+
+    # Points the channel's members at the updated channel object.
+    def update_channel(self, channel):
+        for user_id in self.members.get(channel.id, ()):
+            self.channels[user_id] = channel
+
+    # Moves the user to the channel; None means the user left voice.
+    def set_channel(self, user, channel):
+        previous = self.channels.pop(user.id, None)
+        if previous is not None:
+            members = self.members.get(previous.id)
+            if members is not None:
+                members.discard(user.id)
+                if len(members) == 0:
+                    del self.members[previous.id]
+        if channel is not None:
+            self.channels[user.id] = channel
+            self.members.setdefault(channel.id, set()).add(user.id)
+
+    # Returns the voice channel the user is in, or None.
+    def channel_of(self, user):
+        return self.channels.get(user.id)
+
+    # Returns the voice channel the user is in on the server, or None.
+    def channel_in(self, user, server):
+        channel = self.channels.get(user.id)
+        if channel is None or channel.server.id != server.id:
+            return None
+        return channel
+
+    # Returns the server of the voice channel the user is in, or None.
+    def server_of(self, user):
+        channel = self.channels.get(user.id)
+        if channel is None:
+            return None
+        return channel.server
+
+    # Returns the ids of the users in the voice channel.
+    def members_of(self, channel):
+        return self.members.get(channel.id, set())
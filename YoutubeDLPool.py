@@ -0,0 +1,80 @@
+import queue
+import threading
+from contextlib import contextmanager
+import youtube_dl
+from youtube_dl.extractor import gen_extractor_classes
+
+
+# Long-lived YoutubeDL instances for one set of options, so extractors, compiled regexes, player signatures
+# and HTTP connections are reused between jobs. Each instance is used by one thread at a time.
+class YoutubeDLPool:
+    # Extractors created and initialized with every instance, so the first jobs do not pay for it.
+    WARM_EXTRACTORS = ('Youtube', 'YoutubePlaylist', 'YoutubeTab', 'YoutubeSearch', 'Soundcloud', 'SoundcloudSet',
+                       'Generic')
+    # Matched against every extractor to compile their URL patterns.
+    WARM_URL = 'https://www.youtube.com/watch?v=BaW_jenozKc'
+    # Whether this process has compiled the patterns; a forked worker inherits them along with the flag.
+    patterns_compiled = False
+
+    def __init__(self, options, max_idle=8):
+        self.options = options
+        self.idle = queue.LifoQueue(maxsize=max_idle)
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    # Compiles the URL pattern of every extractor, which extract_info otherwise does on the first URLs it
+    # sees. The patterns are cached on the extractor classes, so this runs once per process.
+    @staticmethod
+    def compile_patterns():
+        if YoutubeDLPool.patterns_compiled:
+            return
+        for extractor in gen_extractor_classes():
+            try:
+                extractor.suitable(YoutubeDLPool.WARM_URL)
+            except Exception:
+                pass
+        YoutubeDLPool.patterns_compiled = True
+
+    def create(self):
+        YoutubeDLPool.compile_patterns()
+        ytdl = youtube_dl.YoutubeDL(self.options)
+        for extractor in YoutubeDLPool.WARM_EXTRACTORS:
+            try:
+                ytdl.get_info_extractor(extractor).initialize()
+            except Exception:
+                # Not every youtube-dl version has every extractor.
+                pass
+        with self.lock:
+            self.created += 1
+        return ytdl
+
+    # Lends an instance for the duration of the with block, creating one if none is idle.
+    @contextmanager
+    def instance(self):
+        try:
+            ytdl = self.idle.get_nowait()
+            with self.lock:
+                self.reused += 1
+        except queue.Empty:
+            ytdl = self.create()
+        try:
+            yield ytdl
+        finally:
+            try:
+                self.idle.put_nowait(ytdl)
+            except queue.Full:
+                pass
+
+    # Creates up to count idle instances ahead of the first jobs.
+    def warm(self, count):
+        for _ in range(count - self.idle.qsize()):
+            ytdl = self.create()
+            try:
+                self.idle.put_nowait(ytdl)
+            except queue.Full:
+                break
+
+    def stats(self):
+        with self.lock:
+            return dict(created=self.created, reused=self.reused, idle=self.idle.qsize())
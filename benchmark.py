@@ -0,0 +1,670 @@
+import os
+import sys
+import gc
+import io
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from types import ModuleType
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak memory of the process is not reported.
+    resource = None
+
+
+# Offline benchmark of eMusic: drives its command handlers and playback against stand-ins for Discord and
+# youtube-dl, so nothing touches the network.
+# Example: python benchmark.py --servers 200 --tracks 20 --output before.json
+#          python benchmark.py --servers 200 --tracks 20 --compare before.json
+
+
+# ----- youtube-dl stand-in -----
+
+
+# Settings of the fake extractor; filled in from the command line before eMusic is imported.
+EXTRACTOR = dict(latency=0.02, jitter=0.01, failure_rate=0.0, playlist_size=50, seed=1)
+extractor_random = random.Random(1)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class FakeYoutubeDL:
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    # Sleeps like a real extraction would and returns info shaped like youtube-dl's.
+    def extract_info(self, url, download=False, process=True, ie_key=None):
+        time.sleep(max(0.0, EXTRACTOR['latency'] + extractor_random.uniform(-1, 1) * EXTRACTOR['jitter']))
+        if extractor_random.random() < EXTRACTOR['failure_rate']:
+            raise DownloadError('ERROR: unable to download video data: HTTP Error 500: Internal Server Error')
+
+        if self.options.get('extract_flat') and 'list=' in url:
+            playlist_id = url.split('list=', 1)[1]
+            return dict(_type='playlist', id=playlist_id, title='Playlist ' + playlist_id, entries=[
+                dict(_type='url', ie_key='Youtube', url='{}-{}'.format(playlist_id, i), title='Entry {}'.format(i))
+                for i in range(EXTRACTOR['playlist_size'])])
+
+        video_id = url.split('v=', 1)[1] if 'v=' in url else url.replace(' ', '-')
+        return dict(
+            _type='video',
+            id=video_id,
+            webpage_url='https://www.youtube.com/watch?v={}'.format(video_id),
+            title='Video {}'.format(video_id),
+            uploader='Uploader',
+            duration=180 + len(video_id) % 120,
+            url='https://stream.invalid/{}?expire={}'.format(video_id, int(time.time()) + 21600),
+            formats=[dict(format_id='251', acodec='opus', ext='webm', abr=160, vcodec='none',
+                          url='https://stream.invalid/{}/251'.format(video_id))]
+        )
+
+
+# ----- Discord stand-ins -----
+
+
+# Settings of the fake Discord API.
+DISCORD = dict(api_latency=0.0, time_scale=0.001)
+
+
+# Returns the channel of the command being run, found the way discord.py's say does: in the locals of the
+# command dispatch further up the stack.
+def current_channel():
+    frame = sys._getframe(1)
+    while frame is not None:
+        if '_internal_channel' in frame.f_locals:
+            return frame.f_locals['_internal_channel']
+        frame = frame.f_back
+    return None
+
+
+class Embed:
+    def __init__(self, title=None, description=None, url=None, colour=None):
+        self.title = title
+        self.description = description
+        self.url = url
+        self.colour = colour
+        self.fields = []
+        self.footer = None
+
+    def add_field(self, name, value, inline=True):
+        self.fields.append((name, value, inline))
+
+    def set_footer(self, text):
+        self.footer = text
+
+
+class ChannelType:
+    text = 'text'
+    voice = 'voice'
+
+
+class User:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+        self.voice = VoiceState(None)
+
+    def __str__(self):
+        return self.name
+
+
+class VoiceState:
+    def __init__(self, voice_channel):
+        self.voice_channel = voice_channel
+
+
+class Channel:
+    def __init__(self, channel_id, name, channel_type, server):
+        self.id = channel_id
+        self.name = name
+        self.type = channel_type
+        self.server = server
+        self.voice_members = []
+        self.bitrate = 64000
+
+
+class Server:
+    def __init__(self, server_id):
+        self.id = server_id
+        self.name = 'Server {}'.format(server_id)
+        self.text = Channel(server_id + '-text', 'general', ChannelType.text, self)
+        self.voice = Channel(server_id + '-voice', 'Music', ChannelType.voice, self)
+        self.channels = [self.text, self.voice]
+        self.member = User(server_id + '-user', 'listener')
+        self.member.voice = VoiceState(self.voice)
+        self.voice.voice_members.append(self.member)
+
+    def get_channel(self, channel_id):
+        for channel in self.channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+
+class Message:
+    next_id = 0
+
+    def __init__(self, content, author, channel, embed=None):
+        Message.next_id += 1
+        self.id = str(Message.next_id)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.server = None if channel is None else channel.server
+        self.embed = embed
+
+
+# FFmpeg process of a FakePlayer; playback is simulated, so it outputs no PCM.
+class FakeProcess:
+    def __init__(self, source):
+        self.source = source
+        self.stdout = io.BytesIO()
+
+
+# Player that "plays" for the track's duration scaled by time_scale; held players wait for the harness.
+# Takes the arguments of discord.py's ProcessPlayer, which it stands in for.
+class FakePlayer:
+    def __init__(self, process, voice_client, after, **kwargs):
+        self.voice_client = voice_client
+        self.process = process
+        self.after = after
+        self.buff = process.stdout
+        self.frame_size = 3840
+        self.duration = None
+        self.loops = 0
+        self.started = False
+        self.paused = False
+        self.done = False
+        self.timer = None
+
+    def start(self):
+        self.started = True
+        # The first frame would go out right away.
+        if getattr(self, 'on_first_frame', None) is not None:
+            self.on_first_frame()
+        self.voice_client.bot.harness.player_started(self)
+
+    # Starts the countdown to the end of the track.
+    def play_out(self):
+        if not self.done:
+            self.timer = self.voice_client.bot.loop.call_later((self.duration or 180) * DISCORD['time_scale'],
+                                                               self.finish)
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.after(self)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.finish()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def is_playing(self):
+        return self.started and not self.paused and not self.done
+
+    def is_done(self):
+        return self.done
+
+
+class VoiceClient:
+    def __init__(self, bot, channel):
+        self.bot = bot
+        self.channel = channel
+        self.server = channel.server
+        self.encoder = None
+        self._connected = None
+
+    def create_ffmpeg_player(self, source, before_options=None, after=None, **kwargs):
+        return FakePlayer(FakeProcess(source), self, after)
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self):
+        self.bot.voice_connections.pop(self.server.id, None)
+
+    def play_audio(self, data, encode=True):
+        pass
+
+
+class CommandError(Exception):
+    pass
+
+
+class Command:
+    def __init__(self, name, callback):
+        self.name = name
+        self.callback = callback
+
+
+class Context:
+    def __init__(self, message):
+        self.message = message
+
+
+class Bot:
+    def __init__(self, command_prefix, help_attrs=None, **kwargs):
+        self.command_prefix = command_prefix
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.user = User('bot', 'eMusic', bot=True)
+        self.commands = {}
+        self.server_map = {}
+        self.voice_connections = {}
+        self.is_closed = False
+        self.harness = None
+
+    @property
+    def servers(self):
+        return list(self.server_map.values())
+
+    @property
+    def voice_clients(self):
+        return list(self.voice_connections.values())
+
+    def event(self, func):
+        return func
+
+    def command(self, pass_context=False, aliases=(), **kwargs):
+        def decorator(func):
+            command = Command(func.__name__, func)
+            for name in [func.__name__] + list(aliases):
+                self.commands[name] = command
+            return command
+        return decorator
+
+    async def process_commands(self, message):
+        if not message.content.startswith(self.command_prefix):
+            return
+        command = self.commands.get(message.content[len(self.command_prefix):].split(' ', 1)[0])
+        if command is None:
+            return
+        _internal_channel = message.channel
+        await command.callback(Context(message))
+
+    async def api_call(self):
+        if DISCORD['api_latency'] > 0:
+            await asyncio.sleep(DISCORD['api_latency'])
+
+    async def say(self, content=None, embed=None, **kwargs):
+        await self.api_call()
+        return Message(content, self.user, current_channel(), embed)
+
+    async def send_message(self, destination, content=None, embed=None, **kwargs):
+        await self.api_call()
+        return Message(content, self.user, destination if isinstance(destination, Channel) else None, embed)
+
+    async def edit_message(self, message, content=None, embed=None, **kwargs):
+        await self.api_call()
+        message.content = content
+        return message
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_server(self, server_id):
+        return self.server_map.get(server_id)
+
+    def voice_client_in(self, server):
+        return self.voice_connections.get(server.id)
+
+    def is_voice_connected(self, server):
+        return server.id in self.voice_connections
+
+    async def join_voice_channel(self, channel):
+        await self.api_call()
+        voice_client = VoiceClient(self, channel)
+        self.voice_connections[channel.server.id] = voice_client
+        return voice_client
+
+
+class StreamPlayer:
+    def __init__(self, stream, encoder, connected, player, after, **kwargs):
+        self.after = after
+        self.player = player
+        self.loops = 0
+
+
+class OpusEncoder:
+    def __init__(self, *args, **kwargs):
+        raise RuntimeError('The benchmark does not encode audio; run it with shared-encode off.')
+
+
+# Puts the stand-ins where eMusic imports discord and youtube_dl from.
+def install_fakes():
+    discord = ModuleType('discord')
+    discord.Embed = Embed
+    discord.ChannelType = ChannelType
+    discord.Client = Bot
+    ext = ModuleType('discord.ext')
+    commands = ModuleType('discord.ext.commands')
+    commands.Bot = Bot
+    commands.CommandError = CommandError
+    voice_client = ModuleType('discord.voice_client')
+    voice_client.StreamPlayer = StreamPlayer
+    voice_client.ProcessPlayer = FakePlayer
+    opus = ModuleType('discord.opus')
+    opus.Encoder = OpusEncoder
+    discord.ext = ext
+    ext.commands = commands
+    discord.voice_client = voice_client
+    discord.opus = opus
+
+    youtube_dl = ModuleType('youtube_dl')
+    youtube_dl.YoutubeDL = FakeYoutubeDL
+    youtube_dl_utils = ModuleType('youtube_dl.utils')
+    youtube_dl_utils.DownloadError = DownloadError
+    youtube_dl.utils = youtube_dl_utils
+    youtube_dl_extractor = ModuleType('youtube_dl.extractor')
+    youtube_dl_extractor.gen_extractor_classes = lambda: []
+    youtube_dl.extractor = youtube_dl_extractor
+
+    sys.modules.update({
+        'discord': discord, 'discord.ext': ext, 'discord.ext.commands': commands,
+        'discord.voice_client': voice_client, 'discord.opus': opus,
+        'youtube_dl': youtube_dl, 'youtube_dl.utils': youtube_dl_utils,
+        'youtube_dl.extractor': youtube_dl_extractor,
+    })
+
+
+# ----- Harness -----
+
+
+# Returns the q quantile of the values, or 0 if there are none.
+def quantile(values, q):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def describe(values):
+    return dict(count=len(values), p50=quantile(values, 0.5), p99=quantile(values, 0.99),
+                mean=sum(values) / len(values) if len(values) > 0 else 0.0)
+
+
+class Harness:
+    def __init__(self, emusic, args):
+        self.emusic = emusic
+        self.args = args
+        self.bot = emusic.bot
+        self.bot.harness = self
+        self.random = random.Random(args.seed)
+        self.servers = []
+        self.hold = True
+        self.held = []
+        self.latencies = {}  # command name -> seconds
+        self.observed = {}  # metric name -> every observed value
+        self.commands = 0
+
+        # Keep every observation instead of the metrics' recent window.
+        observe = emusic.metrics.observe
+
+        def record(name, value, **labels):
+            self.observed.setdefault(name, []).append(value)
+            observe(name, value, **labels)
+        emusic.metrics.observe = record
+
+    def player_started(self, player):
+        if self.hold:
+            self.held.append(player)
+        else:
+            player.play_out()
+
+    # Lets every held player play out.
+    def release(self):
+        self.hold = False
+        for player in self.held:
+            player.play_out()
+        self.held = []
+
+    def add_servers(self, count):
+        for i in range(count):
+            server = Server('{:05d}'.format(i))
+            self.bot.server_map[server.id] = server
+            self.servers.append(server)
+        self.emusic.voice_states.rebuild(self.bot.servers)
+
+    async def command(self, server, content):
+        message = Message(self.emusic.CMD_PREFIX + content, server.member, server.text)
+        name = content.split(' ', 1)[0]
+        started = time.perf_counter()
+        await self.emusic.on_message(message)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        self.commands += 1
+
+    # Returns the link of the index-th track of the server; a share of them are popular across servers.
+    def track_link(self, server, index):
+        if self.random.random() < self.args.popular:
+            video = 'popular{}'.format(self.random.randrange(50))
+        else:
+            video = '{}-{}'.format(server.id, index)
+        return 'https://www.youtube.com/watch?v={}'.format(video)
+
+    # Queues the server's tracks and playlist and looks at its queue the way users do.
+    async def fill_server(self, server, index):
+        for i in range(self.args.tracks):
+            await self.command(server, 'play ' + self.track_link(server, i))
+        if index < self.args.playlist_servers:
+            await self.command(server, 'play https://www.youtube.com/playlist?list=PL{}'.format(server.id))
+        for page in range(1, 4):
+            await self.command(server, 'queue {}'.format(page))
+        await self.command(server, 'remove 2')
+        await self.command(server, 'move 3 1')
+
+    # Seeks in and skips a few tracks while the server plays through its queue.
+    async def play_server(self, server):
+        for _ in range(self.args.seeks):
+            await asyncio.sleep(self.random.uniform(0, 60 * DISCORD['time_scale']))
+            await self.command(server, 'forward 30')
+        for _ in range(self.args.skips):
+            await asyncio.sleep(self.random.uniform(0, 180 * DISCORD['time_scale']))
+            await self.command(server, 'skip')
+
+    def busy(self):
+        return any(not session.is_idle() for session in self.emusic.SERVER_SESSIONS.values())
+
+    async def wait_idle(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while self.busy() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    def queued_tracks(self):
+        return sum(len(session.queue) + (session.track is not None)
+                   for session in self.emusic.SERVER_SESSIONS.values())
+
+    async def run(self):
+        args = self.args
+        self.add_servers(args.servers)
+        self.emusic.coalescer.start(self.bot.loop)
+        lag_task = self.bot.loop.create_task(self.emusic.measure_loop_lag())
+
+        # Queueing: players are held so every queue is full at the end.
+        started = time.perf_counter()
+        await asyncio.gather(*[self.fill_server(server, i) for i, server in enumerate(self.servers)])
+        await self.wait_playlists(args.timeout)
+        fill_time = time.perf_counter() - started
+        fill_commands = self.commands
+        queued = self.queued_tracks()
+
+        # Playback: every server plays through its queue.
+        started = time.perf_counter()
+        self.release()
+        await asyncio.gather(*[self.play_server(server) for server in self.servers])
+        await self.wait_idle(args.timeout)
+        play_time = time.perf_counter() - started
+        lag_task.cancel()
+
+        memory = await self.measure_memory()
+        return self.report(fill_time, fill_commands, queued, play_time, memory)
+
+    async def wait_playlists(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while any(len(session.playlists) > 0 for session in self.emusic.SERVER_SESSIONS.values()) \
+                and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    # Queues tracks whose metadata is already cached and returns the bytes allocated per queued track.
+    async def measure_memory(self):
+        self.hold = True
+        count = self.args.memory_tracks
+        server = self.servers[0]
+        links = [self.track_link(server, i) for i in range(count)]
+        for link in links:
+            # Resolve first so only the queue entries are measured.
+            await self.emusic.resolve_track(link, server.id)
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for link in links:
+            await self.command(server, 'play ' + link)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return (after - before) / count
+
+    def report(self, fill_time, fill_commands, queued, play_time, memory):
+        scheduler = self.emusic.scheduler.stats()
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return dict(
+            settings=dict((name, value) for name, value in vars(self.args).items()
+                          if name not in ('output', 'compare')),
+            python=sys.version.split()[0],
+            commands=self.commands,
+            command_throughput=fill_commands / fill_time if fill_time > 0 else 0.0,
+            fill_seconds=fill_time,
+            play_seconds=play_time,
+            queued_tracks=queued,
+            command_latency=describe(all_latencies),
+            command_latency_by_command=dict((name, describe(values))
+                                            for name, values in sorted(self.latencies.items())),
+            time_to_first_audio=describe(self.observed.get('time_to_first_audio_seconds', [])),
+            inter_track_gap=describe(self.observed.get('inter_track_gap_seconds', [])),
+            seek=describe(self.observed.get('seek_seconds', [])),
+            extraction=describe(self.observed.get('extraction_seconds', [])),
+            extraction_wait=describe(self.observed.get('extraction_wait_seconds', [])),
+            loop_lag=describe(self.observed.get('loop_lag_seconds', [])),
+            extractions=dict(completed=scheduler['completed'], failed=scheduler['failed']),
+            bytes_per_queued_track=memory,
+            max_rss_kb=None if resource is None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+
+# Prints the headline figures, next to a previous run's if there is one.
+def print_report(result, previous=None):
+    rows = [
+        ('commands/s', result['command_throughput'], '{:.1f}'),
+        ('command p50 ms', result['command_latency']['p50'] * 1000, '{:.2f}'),
+        ('command p99 ms', result['command_latency']['p99'] * 1000, '{:.2f}'),
+        ('first audio p50 ms', result['time_to_first_audio']['p50'] * 1000, '{:.2f}'),
+        ('first audio p99 ms', result['time_to_first_audio']['p99'] * 1000, '{:.2f}'),
+        ('track gap p50 ms', result['inter_track_gap']['p50'] * 1000, '{:.2f}'),
+        ('track gap p99 ms', result['inter_track_gap']['p99'] * 1000, '{:.2f}'),
+        ('seek p99 ms', result['seek']['p99'] * 1000, '{:.2f}'),
+        ('loop lag p99 ms', result['loop_lag']['p99'] * 1000, '{:.2f}'),
+        ('bytes/queued track', result['bytes_per_queued_track'], '{:.0f}'),
+        ('max rss MB', None if result['max_rss_kb'] is None else result['max_rss_kb'] / 1024, '{:.1f}'),
+    ]
+    keys = ['command_throughput', ('command_latency', 'p50'), ('command_latency', 'p99'),
+            ('time_to_first_audio', 'p50'), ('time_to_first_audio', 'p99'), ('inter_track_gap', 'p50'),
+            ('inter_track_gap', 'p99'), ('seek', 'p99'), ('loop_lag', 'p99'), 'bytes_per_queued_track', 'max_rss_kb']
+    print('{} servers, {} commands, {} tracks queued'.format(result['settings']['servers'], result['commands'],
+                                                           result['queued_tracks']))
+    for (label, value, fmt), key in zip(rows, keys):
+        line = '{:<20} {:>12}'.format(label, 'n/a' if value is None else fmt.format(value))
+        if previous is not None:
+            # Results of older versions may not have every figure.
+            old = previous.get(key[0], {}).get(key[1]) if isinstance(key, tuple) else previous.get(key)
+            new = result[key[0]][key[1]] if isinstance(key, tuple) else result[key]
+            if old and new is not None:
+                line += '  {:+.1f}%'.format((new - old) / old * 100)
+        print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the eMusic command handlers and playback.')
+    parser.add_argument('--servers', type=int, default=100)
+    parser.add_argument('--tracks', type=int, default=20, help='songs queued per server')
+    parser.add_argument('--playlist-servers', type=int, default=10, help='servers that also queue a playlist')
+    parser.add_argument('--playlist-size', type=int, default=50)
+    parser.add_argument('--popular', type=float, default=0.2, help='share of songs picked from 50 popular ones')
+    parser.add_argument('--seeks', type=int, default=1, help='forward seeks per server during playback')
+    parser.add_argument('--skips', type=int, default=2, help='skips per server during playback')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per fake extraction')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds per fake Discord request')
+    parser.add_argument('--time-scale', type=float, default=0.001, help='playback seconds per track second')
+    parser.add_argument('--workers', type=int, default=4, help='extraction workers')
+    parser.add_argument('--memory-tracks', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    EXTRACTOR.update(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                     playlist_size=args.playlist_size, seed=args.seed)
+    extractor_random.seed(args.seed)
+    DISCORD.update(api_latency=args.api_latency, time_scale=args.time_scale)
+    install_fakes()
+
+    # eMusic reads its properties from the working directory on import.
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, source_dir)
+    work_dir = tempfile.mkdtemp(prefix='emusic-benchmark-')
+    previous_dir = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        with open('emusic_properties.yml', 'w') as properties:
+            properties.write('\n'.join([
+                'bot-id: "benchmark"', 'bot-token: "benchmark"', 'cmd-prefix: "-"',
+                'extraction-workers: {}'.format(args.workers), 'shared-encode: false',
+                'metrics-log-interval: 0', ''
+            ]))
+        import eMusic
+        harness = Harness(eMusic, args)
+        result = eMusic.bot.loop.run_until_complete(harness.run())
+        eMusic.bot.is_closed = True
+        eMusic.scheduler.shutdown()
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+    print_report(result, previous)
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
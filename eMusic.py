@@ -1,41 +1,204 @@
 import os
 import sys
+import time
 import math
+import json
 import yaml
+import signal
 import asyncio
 import discord
+import functools
+from collections import deque
 from datetime import datetime
 from discord.ext import commands
 from PlayerPlaylist import PlayerPlaylist
+from ServerSession import ServerSession
+from VoiceStateIndex import VoiceStateIndex
+from MessageCoalescer import MessageCoalescer
+from Track import Track
+from TrackPrefetcher import TrackPrefetcher
+from ExtractionScheduler import ExtractionScheduler
+from Extraction import extract_track_info, is_backend_error, pool, warm_pools
+from MetadataCache import MetadataCache, TTLCache
+from CircuitBreaker import CircuitBreaker
+from SingleFlight import SingleFlight
+from AudioCache import AudioCache
+from OpusBroadcast import OpusBroadcaster
+from FramePlayer import FramePlayer
+from ReadAheadBuffer import ReadAheadBuffer
+from BufferedProcessPlayer import BufferedProcessPlayer
+from QueueStore import QueueStore
+from Metrics import Metrics, MetricsServer
+from ShardSupervisor import ShardSupervisor
+from LogWriter import LogWriter
 
 properties_file_path = 'emusic_properties.yml'
-exception_log_path = 'emusic_exception_log.txt'
+exception_log_path = 'emusic_exception_log.jsonl'
+metrics_log_path = 'emusic_metrics_log.txt'
+RECONNECT_OPTIONS = ['-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
 
 BOT_ID = ''
 BOT_TOKEN = ''
 CMD_PREFIX = ''
+PREFETCH_COUNT = 2
+PREFETCH_LEAD_TIME = 30
+STREAM_URL_TTL = 1800
+EXTRACTION_WORKERS = 4
+EXTRACTION_EXECUTOR = 'thread'
+METADATA_CACHE_SIZE = 5000
+METADATA_TTL = 86400
+SEARCH_TTL = 3600
+METADATA_CACHE_FILE = None
+AUDIO_CACHE_DIR = None
+AUDIO_CACHE_SIZE = 1024
+AUDIO_CACHE_POLICY = 'lru'
+AUDIO_CACHE_MIN_PLAYS = 2
+AUDIO_CACHE_MAX_DURATION = 900
+SHARED_ENCODE = True
+PLAYLIST_RESOLVE_WIDTH = 4
+NEGATIVE_CACHE_TTL = 300
+QUEUE_STORE_FILE = None
+QUEUE_STORE_INTERVAL = 1
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+METRICS_LOG_INTERVAL = 300
+REAPER_INTERVAL = 30
+EMPTY_CHANNEL_TIMEOUT = 120
+IDLE_TIMEOUT = 600
+PAUSED_TIMEOUT = 900
+SESSION_TIMEOUT = 3600
+SHARD_COUNT = 1
+SHARD_ID = None
+SEEK_STEP = 10
+READ_AHEAD_MIN = 0.5
+READ_AHEAD_MAX = 10
+LOG_MAX_BYTES = 10485760
+LOG_BACKUPS = 3
+LOG_QUEUE_SIZE = 10000
+log_writer = None
 bot = None
-
-SERVER_PLAYERS = {}
-SERVER_QUEUES = {}
-SERVER_PLAYLISTS = {}
+prefetcher = None
+scheduler = None
+metadata_cache = None
+audio_cache = None
+broadcaster = None
+coalescer = None
+failed_sources = None
+breaker = None
+extractions = None
+# Normalized source -> dict(server_id, priority, future) of the scheduler job of an extraction in flight.
+extraction_jobs = {}
+queue_store = None
+restored = False
+metrics = None
+metrics_server = None
+
+SERVER_SESSIONS = {}
+voice_states = VoiceStateIndex()
 
 
 # Get needed bot info from the properties file.
 def initialize_bot():
     if os.path.isfile(properties_file_path):
-        properties = yaml.load(open(properties_file_path))
+        with open(properties_file_path) as properties_file:
+            properties = yaml.safe_load(properties_file)
 
         if len(properties) < 3:
             print('Missing properties; bot may not work properly.')
 
-        global BOT_ID, BOT_TOKEN, CMD_PREFIX, bot
+        global BOT_ID, BOT_TOKEN, CMD_PREFIX, PREFETCH_COUNT, PREFETCH_LEAD_TIME, STREAM_URL_TTL
+        global EXTRACTION_WORKERS, EXTRACTION_EXECUTOR, METADATA_CACHE_SIZE, METADATA_TTL, SEARCH_TTL
+        global METADATA_CACHE_FILE, AUDIO_CACHE_DIR, AUDIO_CACHE_SIZE, AUDIO_CACHE_POLICY, AUDIO_CACHE_MIN_PLAYS
+        global AUDIO_CACHE_MAX_DURATION, SHARED_ENCODE, bot, prefetcher, scheduler, metadata_cache, audio_cache
+        global PLAYLIST_RESOLVE_WIDTH, NEGATIVE_CACHE_TTL, broadcaster, coalescer, failed_sources, breaker
+        global QUEUE_STORE_FILE, QUEUE_STORE_INTERVAL, queue_store, METRICS_HOST, METRICS_PORT, METRICS_LOG_INTERVAL
+        global metrics, metrics_server, SHARD_COUNT, SHARD_ID, REAPER_INTERVAL, EMPTY_CHANNEL_TIMEOUT, IDLE_TIMEOUT
+        global PAUSED_TIMEOUT, SESSION_TIMEOUT, SEEK_STEP, LOG_MAX_BYTES, LOG_BACKUPS, LOG_QUEUE_SIZE
+        global log_writer, READ_AHEAD_MIN, READ_AHEAD_MAX, extractions, exception_log_path
         BOT_ID = properties['bot-id']
         BOT_TOKEN = properties['bot-token']
         CMD_PREFIX = properties['cmd-prefix']
+        PREFETCH_COUNT = properties.get('prefetch-count', PREFETCH_COUNT)
+        PREFETCH_LEAD_TIME = properties.get('prefetch-lead-time', PREFETCH_LEAD_TIME)
+        STREAM_URL_TTL = properties.get('stream-url-ttl', STREAM_URL_TTL)
+        EXTRACTION_WORKERS = properties.get('extraction-workers', EXTRACTION_WORKERS)
+        EXTRACTION_EXECUTOR = properties.get('extraction-executor', EXTRACTION_EXECUTOR)
+        METADATA_CACHE_SIZE = properties.get('metadata-cache-size', METADATA_CACHE_SIZE)
+        METADATA_TTL = properties.get('metadata-ttl', METADATA_TTL)
+        SEARCH_TTL = properties.get('search-ttl', SEARCH_TTL)
+        METADATA_CACHE_FILE = properties.get('metadata-cache-file', METADATA_CACHE_FILE)
+        AUDIO_CACHE_DIR = properties.get('audio-cache-dir', AUDIO_CACHE_DIR)
+        AUDIO_CACHE_SIZE = properties.get('audio-cache-size', AUDIO_CACHE_SIZE)
+        AUDIO_CACHE_POLICY = properties.get('audio-cache-policy', AUDIO_CACHE_POLICY)
+        AUDIO_CACHE_MIN_PLAYS = properties.get('audio-cache-min-plays', AUDIO_CACHE_MIN_PLAYS)
+        AUDIO_CACHE_MAX_DURATION = properties.get('audio-cache-max-duration', AUDIO_CACHE_MAX_DURATION)
+        SHARED_ENCODE = properties.get('shared-encode', SHARED_ENCODE)
+        PLAYLIST_RESOLVE_WIDTH = properties.get('playlist-resolve-width', PLAYLIST_RESOLVE_WIDTH)
+        NEGATIVE_CACHE_TTL = properties.get('negative-cache-ttl', NEGATIVE_CACHE_TTL)
+        QUEUE_STORE_FILE = properties.get('queue-store-file', QUEUE_STORE_FILE)
+        QUEUE_STORE_INTERVAL = properties.get('queue-store-interval', QUEUE_STORE_INTERVAL)
+        METRICS_HOST = properties.get('metrics-host', METRICS_HOST)
+        METRICS_PORT = properties.get('metrics-port', METRICS_PORT)
+        METRICS_LOG_INTERVAL = properties.get('metrics-log-interval', METRICS_LOG_INTERVAL)
+        REAPER_INTERVAL = properties.get('reaper-interval', REAPER_INTERVAL)
+        EMPTY_CHANNEL_TIMEOUT = properties.get('empty-channel-timeout', EMPTY_CHANNEL_TIMEOUT)
+        IDLE_TIMEOUT = properties.get('idle-timeout', IDLE_TIMEOUT)
+        PAUSED_TIMEOUT = properties.get('paused-timeout', PAUSED_TIMEOUT)
+        SESSION_TIMEOUT = properties.get('session-timeout', SESSION_TIMEOUT)
+        SHARD_COUNT = properties.get('shard-count', SHARD_COUNT)
+        SEEK_STEP = properties.get('seek-step', SEEK_STEP)
+        READ_AHEAD_MIN = properties.get('read-ahead-min', READ_AHEAD_MIN)
+        READ_AHEAD_MAX = properties.get('read-ahead-max', READ_AHEAD_MAX)
+        LOG_MAX_BYTES = properties.get('log-max-bytes', LOG_MAX_BYTES)
+        LOG_BACKUPS = properties.get('log-backups', LOG_BACKUPS)
+        LOG_QUEUE_SIZE = properties.get('log-queue-size', LOG_QUEUE_SIZE)
+        SHARD_ID = shard_argument()
+        if SHARD_ID is not None:
+            # Shards run side by side, so each keeps its own files and a share of the audio cache.
+            if METADATA_CACHE_FILE is not None:
+                METADATA_CACHE_FILE = shard_path(METADATA_CACHE_FILE)
+            if QUEUE_STORE_FILE is not None:
+                QUEUE_STORE_FILE = shard_path(QUEUE_STORE_FILE)
+            if AUDIO_CACHE_DIR is not None:
+                AUDIO_CACHE_DIR = os.path.join(AUDIO_CACHE_DIR, 'shard{}'.format(SHARD_ID))
+                AUDIO_CACHE_SIZE = AUDIO_CACHE_SIZE / SHARD_COUNT
+            if METRICS_PORT is not None:
+                METRICS_PORT = ShardSupervisor.shard_metrics_port(METRICS_PORT, SHARD_ID)
+            exception_log_path = shard_path(exception_log_path)
+        if supervising():
+            # The shards set up the rest for themselves.
+            return
+        log_writer = LogWriter(exception_log_path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                               queue_size=LOG_QUEUE_SIZE)
 
         # Disable default help command to use custom one later.
-        bot = commands.Bot(command_prefix=CMD_PREFIX, help_attrs={'disabled': True})
+        if SHARD_ID is not None:
+            bot = commands.Bot(command_prefix=CMD_PREFIX, help_attrs={'disabled': True}, shard_id=SHARD_ID,
+                               shard_count=SHARD_COUNT)
+        else:
+            bot = commands.Bot(command_prefix=CMD_PREFIX, help_attrs={'disabled': True})
+        metadata_cache = MetadataCache(max_entries=METADATA_CACHE_SIZE, metadata_ttl=METADATA_TTL,
+                                       search_ttl=SEARCH_TTL, stream_url_ttl=STREAM_URL_TTL,
+                                       path=METADATA_CACHE_FILE)
+        try:
+            metadata_cache.load()
+        except (OSError, ValueError) as e:
+            exception_log_write(e)
+        if AUDIO_CACHE_DIR is not None:
+            audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_SIZE * 1024 * 1024, policy=AUDIO_CACHE_POLICY,
+                                     min_plays=AUDIO_CACHE_MIN_PLAYS, max_duration=AUDIO_CACHE_MAX_DURATION)
+        if SHARED_ENCODE:
+            broadcaster = OpusBroadcaster()
+        failed_sources = TTLCache(METADATA_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+        breaker = CircuitBreaker()
+        extractions = SingleFlight(bot.loop)
+        if QUEUE_STORE_FILE is not None:
+            queue_store = QueueStore(QUEUE_STORE_FILE)
+        coalescer = MessageCoalescer(bot, on_error=exception_log_write)
+        scheduler = ExtractionScheduler(bot.loop, workers=EXTRACTION_WORKERS, executor=EXTRACTION_EXECUTOR)
+        metrics = Metrics()
+        if METRICS_PORT is not None:
+            metrics_server = MetricsServer(metrics, host=METRICS_HOST, port=METRICS_PORT)
     else:
         exception = 'Properties file not found at: {}\nExiting.'.format(properties_file_path)
         print(exception)
@@ -43,23 +206,118 @@ def initialize_bot():
         sys.exit()
 
 
-# Method for logging exceptions.
-def exception_log_write(exception):
-    with open(exception_log_path, 'a') as exception_log:
-        exception_log.write('{} | {}'.format(datetime.now(), exception))
+# Sets up what needs the functions below; called once the whole module is loaded.
+def initialize_services():
+    global prefetcher
+    prefetcher = TrackPrefetcher(bot.loop, refresh_track, get_upcoming_tracks,
+                                 count=PREFETCH_COUNT, lead_time=PREFETCH_LEAD_TIME)
+    register_metrics()
+
+
+# Returns the shard id given with --shard on the command line, or None.
+def shard_argument():
+    if '--shard' in sys.argv:
+        return int(sys.argv[sys.argv.index('--shard') + 1])
+    return None
+
+
+# Returns True if this process only supervises the shards, which run this script again with --shard.
+def supervising():
+    return __name__ == '__main__' and SHARD_COUNT > 1 and SHARD_ID is None
+
+
+# Returns the path with this process' shard in its name, e.g. emusic_queues.shard0.log.
+def shard_path(path):
+    root, extension = os.path.splitext(path)
+    return '{}.shard{}{}'.format(root, SHARD_ID, extension)
+
+
+# Method for logging exceptions, with what the bot was working on as context, e.g. server, command and source.
+def exception_log_write(exception, **context):
+    record = dict(time=datetime.now().isoformat(), level='error')
+    if isinstance(exception, BaseException):
+        record['exception'] = exception
+    else:
+        record['message'] = str(exception)
+    record.update(context)
+    if log_writer is None:
+        # The properties could not be read, so there is no writer.
+        with open(exception_log_path, 'a') as exception_log:
+            exception_log.write(json.dumps(LogWriter.encode(record), default=str) + '\n')
+    else:
+        log_writer.write(record)
+
+
+# Method for logging the metrics summary.
+def metrics_log_write(lines):
+    with open(metrics_log_path, 'a') as metrics_log:
+        for line in lines:
+            metrics_log.write('{} | {}\n'.format(datetime.now(), line))
 
 
 initialize_bot()
 
+if supervising():
+    ShardSupervisor(os.path.abspath(__file__), SHARD_COUNT, metrics_host=METRICS_HOST,
+                    metrics_port=METRICS_PORT).run()
+    sys.exit()
+
 
 # ----- Events -----
 
 
 @bot.event
 async def on_ready():
+    global restored
     print('Successfully logged in as:', bot.user)
     print('Add me to a server via: https://discordapp.com/api/oauth2/authorize?client_id={}&scope=bot&permissions=1'
           .format(BOT_ID))
+    voice_states.rebuild(bot.servers)
+    # Servers may have been left while the bot was disconnected.
+    server_ids = set(s.id for s in bot.servers)
+    for server_id in list(SERVER_SESSIONS):
+        if server_id not in server_ids:
+            drop_session(server_id)
+
+    if queue_store is not None and not restored:
+        restored = True
+        await restore_sessions()
+
+
+@bot.event
+async def on_server_join(server):
+    voice_states.add_server(server)
+
+
+@bot.event
+async def on_server_remove(server):
+    voice_states.remove_server(server)
+    drop_session(server.id)
+
+
+@bot.event
+async def on_voice_state_update(before, after):
+    voice_states.set_channel(after, after.voice.voice_channel)
+
+
+@bot.event
+async def on_channel_update(before, after):
+    voice_states.update_channel(after)
+
+
+@bot.event
+async def on_channel_delete(channel):
+    voice_states.remove_channel(channel)
+
+
+@bot.event
+async def on_command_error(exception, ctx):
+    if isinstance(exception, commands.CommandNotFound):
+        return
+    server = ctx.message.server
+    exception_log_write(exception, server=None if server is None else server.id,
+                        command=None if ctx.command is None else ctx.command.name,
+                        source=ctx.message.content)
 
 
 @bot.event
@@ -74,7 +332,11 @@ async def on_message(message):
         return
 
     # Needed for any @bot.command() methods to work.
+    command = command_of(message)
+    started = time.time()
     await bot.process_commands(message)
+    if command is not None:
+        metrics.observe('command_latency_seconds', time.time() - started, command=command.name)
 
 
 # ----- Commands -----
@@ -117,21 +379,16 @@ async def leave(ctx):
     author = ctx.message.author
     server = ctx.message.server
     if server is None:
-        for s in bot.servers:
-            for channel in s.channels:
-                if author in channel.voice_members:
-                    voice_client = bot.voice_client_in(s)
-                    if voice_client is None:
-                        await bot.say('{} is not currently connected to a voice channel.'.format(bot.user.name))
-                    else:
-                        await voice_client.disconnect()
-                        await bot.say('{} disconnected from: {}'.format(bot.user.name, voice_client.channel.name))
+        s = voice_states.server_of(author)
+        if s is not None:
+            voice_client = bot.voice_client_in(s)
+            if voice_client is None:
+                await bot.say('{} is not currently connected to a voice channel.'.format(bot.user.name))
+            else:
+                await voice_client.disconnect()
+                await bot.say('{} disconnected from: {}'.format(bot.user.name, voice_client.channel.name))
     elif bot.is_voice_connected(server):
-        voice_client = None
-        for vc in list(bot.voice_clients):
-            if vc.server == ctx.message.server:
-                voice_client = vc
-                break
+        voice_client = bot.voice_client_in(server)
         if voice_client is None:
             await bot.say('{} is not currently connected to a voice channel.'.format(bot.user.name))
         else:
@@ -146,20 +403,23 @@ async def play(ctx):
     command = ctx.message.content
     cmd_args = command.split(" ")
 
-    global SERVER_PLAYERS
-
     if len(cmd_args) <= 1:
         server = ctx.message.server.id
-        if server in SERVER_PLAYERS:
-            player = SERVER_PLAYERS[server]
-            if player is None:
+        if server in SERVER_SESSIONS:
+            session = SERVER_SESSIONS[server]
+            player = session.player
+            if session.is_suspended():
+                await resume_command(ctx, session)
+            elif player is None:
                 await bot.say("-play [Audio Source Link]")
             elif not player.is_playing():
                 player.resume()
+                session.paused_at = None
                 await bot.say('Playback has resumed.', embed=player_info(player))
             else:
                 await bot.say("-play [Audio Source Link]")
     else:
+        requested_at = time.time()
         author = ctx.message.author
         server = ctx.message.server
         if server is None:
@@ -168,22 +428,19 @@ async def play(ctx):
         if voice_client is not None:
             # list= is YouTube and /sets/ is SoundCloud
             if 'list=' in cmd_args[1] or '/sets/' in cmd_args[1]:
-                global SERVER_PLAYLISTS
-                message = await bot.say('Downloading playlist data. This could take a while (about 1 sec per song).')
-                if server.id in SERVER_PLAYLISTS:
-                    SERVER_PLAYLISTS[server.id].append(PlayerPlaylist(message.channel, voice_client, cmd_args[1]))
-                else:
-                    SERVER_PLAYLISTS[server.id] = []
-                    SERVER_PLAYLISTS[server.id].append(PlayerPlaylist(message.channel, voice_client, cmd_args[1]))
+                message = await bot.say('Downloading playlist data; songs are queued as they are found.')
+                playlist = PlayerPlaylist(message.channel, voice_client, cmd_args[1], bot.loop, scheduler)
+                get_session(server.id).playlists.append(playlist)
+                bot.loop.create_task(create_player_list(playlist))
             else:
-                try:
-                    player = await create_player(voice_client, cmd_args[1])
-                except commands.CommandInvokeError:
+                track = await resolve_track(cmd_args[1], server.id)
+                if track is None:
                     await bot.say('Unable to find a video from the source: **{}**'.format(cmd_args[1]))
                     return
-                queued = await queue_player(player, server.id)
+                queued = await queue_track(track, voice_client, on_first_audio=lambda: metrics.observe(
+                    'time_to_first_audio_seconds', time.time() - requested_at))
                 if queued:
-                    await bot.say('__**Added to queue:**__', embed=player_info(player))
+                    await bot.say('__**Added to queue:**__', embed=player_info(track))
                 else:
                     await bot.say('Unable to queue the specified song.')
         else:
@@ -195,11 +452,13 @@ async def info(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
-    if server_id not in SERVER_PLAYERS or SERVER_PLAYERS[server_id] is None:
+    session = SERVER_SESSIONS.get(server.id)
+    if session is not None and session.is_suspended():
+        await bot.say('__**Paused:**__ ', embed=player_info(session.track))
+    elif session is None or session.player is None:
         await bot.say('There is nothing playing.')
     else:
-        await bot.say('__**Now Playing:**__ ', embed=player_info(SERVER_PLAYERS[server_id]))
+        await bot.say('__**Now Playing:**__ ', embed=player_info(session.player))
 
 
 @bot.command(pass_context=True, aliases=['list', 'playlist', 'page'])
@@ -210,24 +469,14 @@ async def queue(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
-
-    if server_id in SERVER_QUEUES:
-        titles = []
-        total_duration = 0
-        for player in SERVER_QUEUES[server_id]:
-            if player.duration is not None:
-                total_duration += player.duration
-            if player.title is not None:
-                titles.append(player.title)
-            else:
-                titles.append(player.url)
+    session = SERVER_SESSIONS.get(server.id)
 
-        if len(titles) == 0:
+    if session is not None:
+        if len(session.queue) == 0:
             await bot.say('Nothing is currently queued.')
         else:
             if len(cmd_args) <= 1:
-                em = await queue_em_info(titles, total_duration, 1)
+                em = await queue_em_info(session, 1)
                 await bot.say(embed=em)
             else:
                 page = 1
@@ -235,7 +484,7 @@ async def queue(ctx):
                     page = int(cmd_args[1])
                 except ValueError:
                     await bot.say('Invalid page number; defaulting to page 1.')
-                em = await queue_em_info(titles, total_duration, page)
+                em = await queue_em_info(session, page)
                 await bot.say(embed=em)
     else:
         await bot.say('Nothing is currently queued.')
@@ -246,17 +495,22 @@ async def skip(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
-
-    global SERVER_PLAYERS
-    if server_id in SERVER_PLAYERS:
-        SERVER_PLAYERS[server_id].stop()
-    await asyncio.sleep(2)  # Lets queue_check() update player.
-    if SERVER_PLAYERS[server_id] is None or SERVER_PLAYERS[server_id].is_done():
+    session = SERVER_SESSIONS.get(server.id)
+
+    if session is not None and session.is_suspended():
+        # Nothing is running for the suspended track; forget it and start the next one.
+        session.track = None
+        await advance_queue(server.id, None)
+    elif session is not None and session.player is not None:
+        player = session.player
+        stop_player(player)
+        # Advance right away; the player's own completion callback becomes a no-op.
+        await advance_queue(server.id, player)
+    if session is None or session.player is None or session.player.is_done():
         await bot.say('No more songs in queue.')
     else:
         await bot.say('Song skipped.')
-        await bot.say('__**Now Playing:**__', embed=player_info(SERVER_PLAYERS[server_id]))
+        await bot.say('__**Now Playing:**__', embed=player_info(session.player))
 
 
 @bot.command(pass_context=True, aliases=['unpause', 'resume'])
@@ -264,16 +518,19 @@ async def pause(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
+    session = SERVER_SESSIONS.get(server.id)
 
-    global SERVER_PLAYERS
-    if server_id in SERVER_PLAYERS:
-        player = SERVER_PLAYERS[server_id]
+    if session is not None and session.is_suspended():
+        await resume_command(ctx, session)
+    elif session is not None and session.player is not None:
+        player = session.player
         if player.is_playing():
             player.pause()
+            session.paused_at = time.time()
             await bot.say('Playback has been paused.')
         else:
             player.resume()
+            session.paused_at = None
             await bot.say('Playback has resumed.', embed=player_info(player))
     else:
         await bot.say('There is currently nothing playing to paused.')
@@ -284,43 +541,79 @@ async def stop(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
-
-    global SERVER_PLAYERS
-    if server_id in SERVER_PLAYERS:
-        player = SERVER_PLAYERS[server_id]
-        if player.is_playing():
-            SERVER_PLAYERS[server_id].stop()
+    session = SERVER_SESSIONS.get(server.id)
+
+    if session is not None and session.player is not None:
+        player = session.player
+        if not player.is_done():
+            # Suspended rather than finished, so play resumes the song where it stopped.
+            async with session.lock:
+                if session.player is player:
+                    suspend_player(session, bot.voice_client_in(server))
             await bot.say('Playback has been stopped.')
         else:
             await bot.say('Playback is already stopped or paused.')
+    elif session is not None and session.is_suspended():
+        await bot.say('Playback is already stopped or paused.')
     else:
         await bot.say('There is currently nothing playing to stop.')
 
 
+@bot.command(pass_context=True, aliases=['jump'])
+async def seek(ctx):
+    cmd_args = ctx.message.content.split(' ')
+    if len(cmd_args) < 2:
+        await bot.say('{}seek [Position, e.g. 1:30]'.format(CMD_PREFIX))
+        return
+    position = parse_position(cmd_args[1])
+    if position is None:
+        await bot.say('**{}** is not a valid position.'.format(cmd_args[1]))
+        return
+    await seek_command(ctx, lambda current: position)
+
+
+@bot.command(pass_context=True, aliases=['rw'])
+async def rewind(ctx):
+    cmd_args = ctx.message.content.split(' ')
+    seconds = SEEK_STEP if len(cmd_args) < 2 else parse_position(cmd_args[1])
+    if seconds is None:
+        await bot.say('**{}** is not a valid number of seconds.'.format(cmd_args[1]))
+        return
+    await seek_command(ctx, lambda current: current - seconds)
+
+
+@bot.command(pass_context=True, aliases=['ff'])
+async def forward(ctx):
+    cmd_args = ctx.message.content.split(' ')
+    seconds = SEEK_STEP if len(cmd_args) < 2 else parse_position(cmd_args[1])
+    if seconds is None:
+        await bot.say('**{}** is not a valid number of seconds.'.format(cmd_args[1]))
+        return
+    await seek_command(ctx, lambda current: current + seconds)
+
+
 @bot.command(pass_context=True, aliases=['cancel', 'ditch'])
 async def remove(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
+    session = SERVER_SESSIONS.get(server.id)
 
-    global SERVER_QUEUES
-    if server_id in SERVER_QUEUES:
+    if session is not None:
         cmd_args = ctx.message.content.split(' ')
-        if len(SERVER_QUEUES[server_id]) == 0:
+        if len(session.queue) == 0:
             await bot.say('There is no queue to remove from.')
             return
         if len(cmd_args) > 1:
             try:
-                player = SERVER_QUEUES[server_id].pop(int(cmd_args[1]) - 1)
-                await bot.say('__**Removed from queue:**__', embed=player_info(player))
-            except KeyError:
+                track = session.queue.remove(int(cmd_args[1]) - 1)
+                await bot.say('__**Removed from queue:**__', embed=player_info(track))
+            except (IndexError, ValueError):
                 await bot.say('**{}** is not a valid number.'.format(cmd_args[1]))
                 return
         else:
-            player = SERVER_QUEUES[server_id].pop()
-            await bot.say('__**Removed from queue:**__', embed=player_info(player))
+            track = session.queue.pop()
+            await bot.say('__**Removed from queue:**__', embed=player_info(track))
     else:
         await bot.say('There is no queue to remove from.')
 
@@ -330,14 +623,13 @@ async def clear(ctx):
     server = ctx.message.server
     if server is None:
         server = get_voice_connected_server(ctx.message.author)
-    server_id = server.id
+    session = SERVER_SESSIONS.get(server.id)
 
-    global SERVER_QUEUES
-    if server_id in SERVER_QUEUES:
-        if len(SERVER_QUEUES[server_id]) == 0:
+    if session is not None:
+        if len(session.queue) == 0:
             await bot.say('There was no queue to clear.')
         else:
-            SERVER_QUEUES[server_id] = []
+            session.queue.clear()
             await bot.say('The queue has been cleared.')
     else:
         await bot.say('There was no queue to clear.')
@@ -351,59 +643,152 @@ async def reset(ctx):
         server = get_voice_connected_server(ctx.message.author)
     server_id = server.id
 
-    global SERVER_PLAYERS, SERVER_QUEUES
-    if server_id in SERVER_QUEUES:
-        SERVER_QUEUES[server_id] = []
+    prefetcher.stop(server_id)
+    scheduler.cancel_server(server_id)
+    session = SERVER_SESSIONS.get(server_id)
+    if session is not None:
+        for playlist in session.playlists:
+            playlist.cancel()
+        session.playlists = []
+        session.queue.clear()
         await bot.say('Queue has been cleared.')
-    if server_id in SERVER_PLAYERS:
+
         voice_client = bot.voice_client_in(server)
-        if SERVER_PLAYERS[server_id] is not None and SERVER_PLAYERS[server_id].is_playing():
-            SERVER_PLAYERS[server_id].stop()
+        player = session.player
+        # Cleared first so the player's completion callback does not start anything.
+        session.player = None
+        session.track = None
+        store_current(session, None)
+        if player is not None and not player.is_done():
+            stop_player(player)
             await bot.say('Playback has been stopped.')
         if voice_client is not None:
             voice_channel_name = voice_client.channel.name
             await voice_client.disconnect()
             await bot.say('{} has disconnected from **{}**.'.format(bot.user.name, voice_channel_name))
-        SERVER_PLAYERS[server_id] = None
         await bot.say('Player has been cleared.')
     await bot.say('{} has finished resetting.'.format(bot.user.name))
 
 
+@bot.command(pass_context=True, aliases=['reorder'])
+async def move(ctx):
+    server = ctx.message.server
+    if server is None:
+        server = get_voice_connected_server(ctx.message.author)
+    session = SERVER_SESSIONS.get(server.id)
+
+    cmd_args = ctx.message.content.split(' ')
+    if session is None or len(session.queue) == 0:
+        await bot.say('There is no queue to move songs in.')
+    elif len(cmd_args) < 3:
+        await bot.say('{}move [Position] [New Position]'.format(CMD_PREFIX))
+    else:
+        try:
+            track = session.queue.move(int(cmd_args[1]) - 1, int(cmd_args[2]) - 1)
+        except (IndexError, ValueError):
+            await bot.say('**{}** is not a valid number.'.format(cmd_args[1]))
+            return
+        prefetcher.queue_changed(server.id)
+        await bot.say('__**Moved to position {}:**__'.format(cmd_args[2]), embed=player_info(track))
+
+
+@bot.command(pass_context=True, aliases=['status'])
+async def stats(ctx):
+    extraction = scheduler.stats()
+    queued = extraction['queued']
+    title = '{} Stats'.format(bot.user.name)
+    if SHARD_ID is not None:
+        title += ' (shard {}/{})'.format(SHARD_ID, SHARD_COUNT)
+    em = discord.Embed(title=title, colour=0x0000ff)
+    em.add_field(name='Extraction workers:', value='{} busy of {} ({})'.format(
+        extraction['running'], extraction['workers'], extraction['executor']))
+    em.add_field(name='Extraction queue:',
+                 value='Interactive: {} | Prefetch: {} | Bulk: {}'.format(
+                     queued['interactive'], queued['prefetch'], queued['bulk']),
+                 inline=False)
+    em.add_field(name='Extraction wait:',
+                 value='Avg: {0:.2f}s | P90: {1:.2f}s | Max: {2:.2f}s'.format(
+                     extraction['wait_avg'], extraction['wait_p90'], extraction['wait_max']),
+                 inline=False)
+    deduplication = extractions.stats()
+    em.add_field(name='Extractions:',
+                 value='Completed: {} | Failed: {} | Shared: {}'.format(
+                     extraction['completed'], extraction['failed'], deduplication['deduplicated']),
+                 inline=False)
+    if scheduler.streams():
+        instances = pool('track').stats()
+        em.add_field(name='youtube-dl instances:',
+                     value='Created: {} | Reused: {} | Idle: {}'.format(
+                         instances['created'], instances['reused'], instances['idle']),
+                     inline=False)
+    for name, table in sorted(metadata_cache.stats().items()):
+        em.add_field(name='{} cache:'.format(name.capitalize()),
+                     value='Hits: {} | Misses: {} | Size: {}'.format(table['hits'], table['misses'], table['size']))
+    if broadcaster is not None:
+        shared = broadcaster.stats()
+        em.add_field(name='Shared encodes:',
+                     value='Active: {} | Listeners: {} | Started: {} | Shared: {} | Passthrough: {}'.format(
+                         shared['active'], shared['listeners'], shared['started'], shared['shared'],
+                         shared['passthrough']),
+                     inline=False)
+    read_ahead = read_ahead_stats()
+    em.add_field(name='Read-ahead:',
+                 value='Buffered: {} of {} frames | Underruns: {}'.format(
+                     read_ahead['fill'], read_ahead['capacity'], read_ahead['underruns']),
+                 inline=False)
+    circuits = breaker.stats()
+    open_backends = [backend for backend, state in circuits['backends'].items() if state != CircuitBreaker.CLOSED]
+    em.add_field(name='Failing sources:',
+                 value='Negative cache hits: {} | Cached: {} | Breaker rejections: {} | Open: {}'.format(
+                     failed_sources.hits, len(failed_sources), circuits['rejected'],
+                     ', '.join(open_backends) if len(open_backends) > 0 else 'none'),
+                 inline=False)
+    em.add_field(name='Progress updates:',
+                 value='Sent: {} | Coalesced: {}'.format(coalescer.sent, coalescer.coalesced),
+                 inline=False)
+    if audio_cache is not None:
+        audio = audio_cache.stats()
+        em.add_field(name='Audio cache:',
+                     value='Hits: {} | Misses: {} | {:.1f}/{:.0f} MB in {} tracks'.format(
+                         audio['hits'], audio['misses'], audio['bytes'] / 1048576, audio['max_bytes'] / 1048576,
+                         audio['entries']),
+                     inline=False)
+    await bot.say(embed=em)
+
+
 # ----- Functions -----
 
 
 # Returns the VoiceClient of the bot; otherwise returns None.
+# The user's channel comes from the voice state index and the client from the bot's own per-server map.
 async def get_voice_client(author, server, channel):
     if channel is None:
         if server is None:
-            for s in bot.servers:
-                for channel in s.channels:
-                    if author in channel.voice_members:
-                        if not bot.is_voice_connected(s):
-                            return await bot.join_voice_channel(channel)
-                        else:
-                            await bot.voice_client_in(s).move_to(channel)
-                            return bot.voice_client_in(s)
+            channel = voice_states.channel_of(author)
+            if channel is not None:
+                s = channel.server
+                if not bot.is_voice_connected(s):
+                    return await bot.join_voice_channel(channel)
+                else:
+                    await bot.voice_client_in(s).move_to(channel)
+                    await adapt_to_channel(bot.voice_client_in(s))
+                    return bot.voice_client_in(s)
 
         voice_channel = None
-        for vc in server.channels:
-            if author in vc.voice_members:
-                voice_channel = vc
+        if server is not None:
+            voice_channel = voice_states.channel_in(author, server)
 
         if voice_channel is None:
             await bot.send_message(author, 'User is not in a voice channel. Unable to connect.')
             return None
         else:
             if bot.is_voice_connected(server):
-                voice_client = None
-                for vc in list(bot.voice_clients):
-                    if vc.server == server:
-                        voice_client = vc
-                        break
+                voice_client = bot.voice_client_in(server)
                 if voice_client is None:
                     return await bot.join_voice_channel(voice_channel)
                 else:
                     await voice_client.move_to(voice_channel)
+                    await adapt_to_channel(voice_client)
                     return bot.voice_client_in(voice_channel.server)
             else:
                 return await bot.join_voice_channel(voice_channel)
@@ -420,89 +805,417 @@ async def get_voice_client(author, server, channel):
             return None
         else:
             if bot.is_voice_connected(server):
-                voice_client = None
-                for vc in list(bot.voice_clients):
-                    if vc.server == server:
-                        voice_client = vc
-                        break
+                voice_client = bot.voice_client_in(server)
                 if voice_client is None:
                     return await bot.join_voice_channel(voice_channel)
                 else:
-                    return await voice_client.move_to(voice_channel)
+                    await voice_client.move_to(voice_channel)
+                    await adapt_to_channel(voice_client)
+                    return voice_client
             else:
                 return await bot.join_voice_channel(voice_channel)
 
 
-# Returns a StreamPlayer created with youtube-dl.
-async def create_player(voice_client, source):
-    youtube_dl_options = dict(
-        format="bestaudio/best",
-        extractaudio=True,
-        audioformat="mp3",
-        noplaylist=True,
-        default_search="auto",
-        quiet=True,
-        nocheckcertificate=True,
-        ignoreerrors=True,
-        no_warnings=True,
-    )
+# Runs youtube-dl for the source on the scheduler; returns None if it failed recently, its backend is failing
+# or the extraction fails. Concurrent calls for the same source share one extraction.
+async def extract_info(server_id, priority, source):
+    key = MetadataCache.normalize(source)
+    if failed_sources.get(key) is not None:
+        return None
+    if key in extractions.flights:
+        # A caller joining at a higher priority, e.g. a play behind another server's playlist, moves the job up.
+        job = extraction_jobs.setdefault(key, dict(server_id=server_id, priority=priority, future=None))
+        if priority < job['priority']:
+            job.update(server_id=server_id, priority=priority)
+            if job['future'] is not None:
+                scheduler.promote(job['future'], server_id, priority)
+    else:
+        extraction_jobs.pop(key, None)
+    # Retried if another server's jobs were cancelled, but not after a reset or leave of this server.
+    cancellations = scheduler.cancellations.get(server_id, 0)
+    return await extractions.do(key, run_extraction, server_id, priority, source, key,
+                                retry=lambda: scheduler.cancellations.get(server_id, 0) == cancellations)
+
+
+async def run_extraction(server_id, priority, source, key):
+    backend = MetadataCache.backend(key)
+    if not breaker.allow(backend):
+        return None
+
+    # Callers that joined before this ran may have left the job at a lower priority than this one.
+    job = extraction_jobs.setdefault(key, dict(server_id=server_id, priority=priority, future=None))
+    if priority < job['priority']:
+        job.update(server_id=server_id, priority=priority)
+    job['future'] = scheduler.submit(job['server_id'], job['priority'], extract_track_info, source)
+    try:
+        info = await job['future']
+    except asyncio.CancelledError:
+        breaker.release(backend)
+        raise
+    except Exception as e:
+        exception_log_write(e, server=server_id, source=source)
+        # A dead or blocked video says nothing about the backend's health.
+        breaker.record(backend, not is_backend_error(e))
+        failed_sources.put(key, True)
+        return None
+    finally:
+        if extraction_jobs.get(key) is job:
+            del extraction_jobs[key]
+    breaker.record(backend, True)
+    if info is None:
+        failed_sources.put(key, True)
+    return info
+
+
+# Returns a Track with the metadata of the source without creating a player; otherwise returns None.
+async def resolve_track(source, server_id):
+    metadata = metadata_cache.get_metadata(source)
+    if metadata is not None:
+        track = Track.from_metadata(source, metadata)
+        stream = metadata_cache.get_stream(source)
+        if stream is not None:
+            track.set_stream_url(stream[0], expires_at=stream[1], formats=stream[2])
+        return track
+
+    info = await extract_info(server_id, ExtractionScheduler.INTERACTIVE, source)
+    if info is None:
+        return None
+    track = Track.from_info(source, info, STREAM_URL_TTL)
+    if track is not None:
+        metadata_cache.store(source, track)
+    return track
+
+
+# Re-resolves the stream URL of an unresolved or stale Track in place; returns True if it is now playable.
+async def refresh_track(server_id, track, priority):
+    # Another server may have resolved the same video recently.
+    stream = metadata_cache.get_stream(track.url)
+    if stream is not None:
+        track.set_stream_url(stream[0], expires_at=stream[1], formats=stream[2])
+        if not track.is_stale():
+            return True
+
+    info = await extract_info(server_id, priority, track.url)
+    if info is not None and track.update(info, STREAM_URL_TTL):
+        metadata_cache.store(track.url, track)
+        session = SERVER_SESSIONS.get(server_id)
+        if session is not None:
+            session.queue.track_updated(track)
+    return not track.is_stale()
+
+
+# Returns a player for the Track starting offset seconds in, playing from the audio cache if possible and
+# otherwise from its stream URL, which is resolved first if it was not prefetched.
+async def create_player(voice_client, track, offset=0):
+    after = functools.partial(player_finished, voice_client.server.id)
+    cached_path = None
+    if audio_cache is not None:
+        cached_path = audio_cache.path_for(track)
+
+    format_id = None
+    passthrough = False
+    if cached_path is not None:
+        source = cached_path
+        before_options = None
+        # Cached audio is already Opus in 20 ms frames.
+        passthrough = True
+    else:
+        await prefetcher.ready(voice_client.server.id, track)
+        if track.is_stale():
+            raise commands.CommandError('Unable to resolve a stream for: {}'.format(track.url))
+        source = track.stream_url
+        before_options = RECONNECT_OPTIONS
+        # The smallest format that still fills the channel's bitrate; Opus can skip the decode and encode.
+        selected = track.select_format(channel_kbps(voice_client.channel), prefer_opus=broadcaster is not None)
+        if selected is not None:
+            source = selected[3]
+            format_id = selected[2]
+            passthrough = selected[1] == 'opus'
+
+    if broadcaster is not None:
+        # Servers playing the same track in the same format share one decode and encode.
+        key = MetadataCache.normalize(track.url)
+        if format_id is not None:
+            key += '#{}'.format(format_id)
+        broadcast, listener = broadcaster.subscribe(key, source, offset=offset, before_options=before_options,
+                                                    passthrough=passthrough)
+        read_ahead = read_ahead_buffer(functools.partial(broadcast.read, listener))
+        player = FramePlayer(voice_client, broadcaster, broadcast, listener, after=after, read_ahead=read_ahead)
+    else:
+        if offset > 0:
+            before_options = (before_options or []) + ['-ss', str(offset)]
+        player = voice_client.create_ffmpeg_player(
+            source,
+            before_options=None if before_options is None else ' '.join(before_options),
+            after=after
+        )
+        # The FFmpeg process is played by a player that counts its frames and reads its PCM through the
+        # read-ahead buffer, if there is one; the player discord.py created for it is never started.
+        read_ahead = read_ahead_buffer(functools.partial(player.process.stdout.read, player.frame_size))
+        player = BufferedProcessPlayer(player.process, voice_client, read_ahead, after=after)
+
+    if cached_path is None and audio_cache is not None and offset == 0:
+        populating = audio_cache.played_live(bot.loop, track)
+        if populating is not None:
+            populating.add_done_callback(log_future_exception)
+    player.download_url = source
+    player.url = track.url
+    player.title = track.title
+    player.uploader = track.uploader
+    player.duration = track.duration
+    player.start_offset = offset
+    player.format_id = format_id
 
-    player = await voice_client.create_ytdl_player(
-        source,
-        ytdl_options=youtube_dl_options,
-        before_options="-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
-    )
+    return player
+
+
+# Returns a ReadAheadBuffer over read_frame sized by the read-ahead properties, or None if they disable it.
+def read_ahead_buffer(read_frame):
+    if not READ_AHEAD_MAX:
+        return None
+    # Frames are 20 ms.
+    return ReadAheadBuffer(read_frame, min_frames=max(1, int(READ_AHEAD_MIN * 50)),
+                           max_frames=int(READ_AHEAD_MAX * 50),
+                           on_underrun=lambda: metrics.inc('read_ahead_underruns_total'))
+
+
+# Returns the buffered frames, buffer capacity and underruns of the playing players' read-ahead buffers.
+def read_ahead_stats():
+    totals = dict(fill=0, capacity=0, underruns=0)
+    for session in list(SERVER_SESSIONS.values()):
+        read_ahead = getattr(session.player, 'read_ahead', None)
+        if read_ahead is not None:
+            for name, value in read_ahead.stats().items():
+                totals[name] += value
+    return totals
 
+
+# Returns the bitrate of the voice channel in kbps.
+def channel_kbps(channel):
+    bitrate = getattr(channel, 'bitrate', None)
+    if not bitrate:
+        return 64
+    return bitrate / 1000
+
+
+# Restarts the playing track in the format that suits the voice channel the bot was moved to, if it differs.
+async def adapt_to_channel(voice_client):
+    session = SERVER_SESSIONS.get(voice_client.server.id)
+    if session is None or session.player is None or session.track is None:
+        return
+    player = session.player
+    if getattr(player, 'format_id', None) is None or not player.is_playing():
+        return
+    selected = session.track.select_format(channel_kbps(voice_client.channel), prefer_opus=broadcaster is not None)
+    if selected is None or selected[2] == player.format_id:
+        return
+
+    async with session.lock:
+        if session.player is not player:
+            return
+        await restart_track(session, voice_client, player_position(player))
+
+
+# Replaces the session's player with one for its Track at position seconds; returns the new player or None.
+# The Track is left suspended at the position if the player cannot be started. Must be called with the
+# session's lock held.
+async def restart_track(session, voice_client, position, on_first_audio=None):
+    player = session.player
+    # Suspended first so the player's completion callback does not advance the queue.
+    session.player = None
+    session.suspended_position = position
+    session.paused_at = None
+    if player is not None:
+        stop_player(player)
+    next_player = await start_track(voice_client, session.track, position, on_first_audio=on_first_audio)
+    if next_player is not None:
+        session.player = next_player
+        session.suspended_position = 0
+    store_current(session, voice_client, position)
+    return next_player
+
+
+# Moves the session's current Track, playing or suspended, to target(current position) seconds.
+# FFmpeg restarts from the resolved stream URL or the audio cache with an input-side -ss, which seeks with
+# HTTP range requests; the Track is only extracted again if its stream URL has expired.
+async def seek_track(session, voice_client, target, on_first_audio=None):
+    async with session.lock:
+        if session.track is None:
+            return None
+        if session.is_suspended():
+            current = session.suspended_position
+        else:
+            current = player_position(session.player)
+        position = max(0, target(current))
+        duration = session.track.duration
+        if duration is not None and position >= duration:
+            position = max(0, duration - 1)
+        session.touch()
+        return await restart_track(session, voice_client, position, on_first_audio=on_first_audio)
+
+
+# Seeks for a command and reports the new position.
+async def seek_command(ctx, target):
+    server = ctx.message.server
+    if server is None:
+        server = get_voice_connected_server(ctx.message.author)
+    session = None if server is None else SERVER_SESSIONS.get(server.id)
+    if session is None or session.track is None:
+        await bot.say('There is currently nothing playing to seek in.')
+        return
+
+    requested_at = time.time()
+    voice_client = bot.voice_client_in(server)
+    if voice_client is None:
+        voice_client = await get_voice_client(ctx.message.author, server, None)
+    player = None
+    if voice_client is not None:
+        player = await seek_track(session, voice_client, target, on_first_audio=lambda: metrics.observe(
+            'seek_seconds', time.time() - requested_at))
+    if player is None:
+        await bot.say('Unable to seek in the song.')
+    else:
+        await bot.say('Playback continues from **{}**.'.format(format_position(player.start_offset)),
+                      embed=player_info(player))
+
+
+# Returns the seconds in a position such as 90, 1:30 or 1:02:03; otherwise returns None.
+def parse_position(text):
+    seconds = 0
+    try:
+        for part in text.split(':'):
+            value = float(part)
+            if value < 0 or not math.isfinite(value):
+                return None
+            seconds = seconds * 60 + value
+    except ValueError:
+        return None
+    return seconds
+
+
+def format_position(seconds):
+    return '{0}:{1:0>2}'.format(int(seconds / 60), int(seconds % 60))
+
+
+# Returns roughly how many seconds into its track the player is.
+def player_position(player):
+    return player.start_offset + player.frames_sent * 0.02
+
+
+# Done callback that logs the exception of a background future.
+def log_future_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        exception_log_write(future.exception())
+
+
+# Creates and starts the player for the Track at offset seconds; returns None if it could not be created.
+# on_first_audio is called once the player sends its first audio.
+async def start_track(voice_client, track, offset=0, on_first_audio=None):
+    if voice_client is None:
+        return None
+    try:
+        player = await create_player(voice_client, track, offset)
+    except Exception as e:
+        exception_log_write(e, server=voice_client.server.id, source=track.url)
+        return None
+    player.on_first_frame = on_first_audio
+    player.start()
+    prefetcher.track_started(voice_client.server.id, None if track.duration is None else track.duration - offset)
     return player
 
 
-# Queues the playlist and sends the progress to Discord.
+# Returns the playlist progress message; the total is unknown while the playlist is still being paged through.
+def playlist_progress(playlist, count):
+    if playlist.total is None:
+        return 'Queueing songs from playlist: {}'.format(count)
+    return 'Queueing songs from playlist: {}/{}'.format(count, playlist.total)
+
+
+# Queues the playlist's tracks as they are enumerated and sends the progress to Discord.
+# Up to PLAYLIST_RESOLVE_WIDTH entries are resolved at once; they are queued in playlist order as soon as
+# every entry before them is done, and entries that fail to resolve are skipped.
 async def create_player_list(playlist):
     channel = playlist.channel
     voice_client = playlist.voice_client
-    server = voice_client.server
+    server_id = voice_client.server.id
 
-    content = 'Queueing songs from playlist: 0/{}'.format(len(playlist.urls))
-    message = await bot.send_message(channel, content)
+    message = await bot.send_message(channel, playlist_progress(playlist, 0))
     count = 0
-    for url in playlist.urls:
-        player = await create_player(voice_client, url)
-        count += 1
-        new_message = 'Queueing songs from playlist: {}/{}'.format(count, len(playlist.urls))
-        await bot.edit_message(message, new_message)
-        queued = await queue_player(player, server.id)
-        if not queued:
-            await bot.send_message(channel, 'Unable to queue {} from the playlist.'.format(player.url))
-    await bot.say('Finished queueing playlist.')
+    pending = playlist.resolutions
+    next_track = None
+    enumerating = True
+    while enumerating or len(pending) > 0:
+        waits = []
+        if enumerating and len(pending) < PLAYLIST_RESOLVE_WIDTH:
+            if next_track is None:
+                next_track = bot.loop.create_task(playlist.tracks.get())
+            waits.append(next_track)
+        if len(pending) > 0:
+            waits.append(pending[0][1])
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+
+        if next_track is not None and next_track.done():
+            track = next_track.result()
+            next_track = None
+            if track is None or playlist.cancelled:
+                enumerating = False
+            else:
+                pending.append((track, bot.loop.create_task(
+                    refresh_track(server_id, track, ExtractionScheduler.BULK))))
+
+        while len(pending) > 0 and pending[0][1].done():
+            track, resolution = pending.popleft()
+            if playlist.cancelled:
+                continue
+            count += 1
+            coalescer.edit(message, playlist_progress(playlist, count))
+            if resolution.cancelled() or not resolution.result() or not await queue_track(track, voice_client):
+                coalescer.notice(channel, 'Unable to queue from the playlist', track.url)
+
+    if next_track is not None:
+        next_track.cancel()
+
+    if playlist.future.done() and not playlist.future.cancelled() and playlist.future.exception() is not None:
+        exception_log_write(playlist.future.exception(), server=server_id)
+    await coalescer.flush(message)
+    session = SERVER_SESSIONS.get(server_id)
+    if session is not None and playlist in session.playlists:
+        session.playlists.remove(playlist)
+    if not playlist.cancelled:
+        await bot.send_message(channel, 'Finished queueing playlist.')
 
 
 # Returns the Server with the bot that the user is connected to; otherwise returns None.
 def get_voice_connected_server(user):
-    for s in bot.servers:
-        for channel in s.channels:
-            if user in channel.voice_members:
-                return s
-    return None
-
-
-# Adds the Player to the queue. Starts it if there is currently nothing playing.
-async def queue_player(player, server_id):
-    if player is not None:
-        global SERVER_PLAYERS
-        if server_id not in SERVER_PLAYERS or SERVER_PLAYERS[server_id] is None:
-            SERVER_PLAYERS[server_id] = player
-            SERVER_PLAYERS[server_id].start()
-        else:
-            global SERVER_QUEUES
-            if server_id not in SERVER_QUEUES:
-                SERVER_QUEUES[server_id] = []
-            SERVER_QUEUES[server_id].append(player)
+    return voice_states.server_of(user)
+
+
+# Adds the Track to the queue. Creates and starts its player if there is currently nothing playing.
+async def queue_track(track, voice_client, on_first_audio=None):
+    if track is not None:
+        server_id = voice_client.server.id
+        session = get_session(server_id)
+        session.touch()
+        async with session.lock:
+            if session.player is None and session.track is None:
+                player = await start_track(voice_client, track, on_first_audio=on_first_audio)
+                if player is None:
+                    return False
+                session.player = player
+                session.track = track
+                store_current(session, voice_client)
+            else:
+                session.queue.append(track)
+                prefetcher.queue_changed(server_id)
+        if session.is_suspended():
+            # Queueing more wakes up the suspended track.
+            await resume_suspended(session, voice_client)
         return True
     else:
         return False
 
 
-# Returns the player info as an embed.
+# Returns the player or Track info as an embed.
 def player_info(player):
     title = player.title
     if title is None:
@@ -525,28 +1238,41 @@ def player_info(player):
 
 
 # Returns the queue info as an embed with pagination.
-async def queue_em_info(titles, total_duration, page):
+# Only the tracks on the page are read and rendered pages are reused until the queue changes.
+async def queue_em_info(session, page):
+    queue = session.queue
     end = page * 5
     if end <= 0:
         end = 5
-    if end > len(titles):
-        end = len(titles)
+    if end > len(queue):
+        end = len(queue)
     start = end - 5
     if start < 0:
         start = 0
 
+    if session.queue_embeds[0] != queue.version:
+        session.queue_embeds = (queue.version, {})
+    em = session.queue_embeds[1].get(end)
+    if em is not None:
+        return em
+
     to_embed = []
-    for i in range(start, end):
-        to_embed.append(titles[i])
+    for track in queue.page(start, end):
+        if track.title is not None:
+            to_embed.append(track.title)
+        else:
+            to_embed.append(track.url)
 
-    current_queue = '__**Current Queue ({}):**__'.format(len(titles))
-    m, s = divmod(total_duration, 60)
+    current_queue = '__**Current Queue ({}):**__'.format(len(queue))
+    m, s = divmod(queue.total_duration, 60)
     h, m = divmod(m, 60)
     playback_time = 'Total playback time: {0:0>2}:{1:0>2}:{2:0>2}'.format(
         h,  # Hours
         m,  # Minutes
         s  # Seconds
     )
+    if queue.unknown_durations > 0:
+        playback_time += ' (+{} of unknown length)'.format(queue.unknown_durations)
     em = discord.Embed(title=current_queue, description=playback_time, colour=0x0000ff)
 
     queue_pos = start + 1
@@ -554,8 +1280,9 @@ async def queue_em_info(titles, total_duration, page):
         em.add_field(name=title, value='Queue position: {}'.format(queue_pos), inline=False)
         queue_pos += 1
 
-    footer = 'Page: {}/{}'.format(math.ceil(end / 5), math.ceil(len(titles) / 5))
+    footer = 'Page: {}/{}'.format(math.ceil(end / 5), math.ceil(len(queue) / 5))
     em.set_footer(text=footer)
+    session.queue_embeds[1][end] = em
     return em
 
 
@@ -584,66 +1311,513 @@ async def show_help(member):
                  value='Displays the current queue if there is one.',
                  inline=False)
     em.add_field(name='{}stop | {}end'.format(CMD_PREFIX, CMD_PREFIX),
-                 value='Stops playback; keeps queue.',
+                 value='Stops playback; keeps queue. Play resumes the song where it stopped.',
+                 inline=False)
+    em.add_field(name='{}seek | {}jump [Position]'.format(CMD_PREFIX, CMD_PREFIX),
+                 value='Continues the current song from the given position, e.g. 90 or 1:30.',
+                 inline=False)
+    em.add_field(name='{}rewind | {}rw [Seconds]'.format(CMD_PREFIX, CMD_PREFIX),
+                 value='Goes back in the current song; {} seconds if no number is given.'.format(SEEK_STEP),
+                 inline=False)
+    em.add_field(name='{}forward | {}ff [Seconds]'.format(CMD_PREFIX, CMD_PREFIX),
+                 value='Goes ahead in the current song; {} seconds if no number is given.'.format(SEEK_STEP),
                  inline=False)
     em.add_field(name='{}remove | {}cancel | {}ditch [Position]'.format(CMD_PREFIX, CMD_PREFIX, CMD_PREFIX),
                  value='Removes the song in the queue at the given position. If no position is given, '
                        'the last song will be removed.',
                  inline=False)
+    em.add_field(name='{}move | {}reorder [Position] [New Position]'.format(CMD_PREFIX, CMD_PREFIX),
+                 value='Moves the song at the given position in the queue to the new position.',
+                 inline=False)
     em.add_field(name='{}clear | {}empty'.format(CMD_PREFIX, CMD_PREFIX),
                  value='Clears the queue.',
                  inline=False)
     em.add_field(name='{}reset | {}restart'.format(CMD_PREFIX, CMD_PREFIX),
                  value='Stops playback, clears the queue, and disconnects from the VoiceChannel.',
                  inline=False)
+    em.add_field(name='{}stats | {}status'.format(CMD_PREFIX, CMD_PREFIX),
+                 value='Displays extraction queue depth, wait times and cache hit rates.',
+                 inline=False)
     em.add_field(name='?{} | {}{}'.format(bot.user.name, CMD_PREFIX, bot.user.name),
                  value='Messages the user a list of commands.',
                  inline=False)
     await bot.send_message(member, embed=em)
 
 
-# Background task that tells the bot to go to the next song if the previous one has finished.
-async def queue_check():
+# Returns the session of the server, creating it if needed.
+def get_session(server_id):
+    session = SERVER_SESSIONS.get(server_id)
+    if session is None:
+        session = ServerSession(server_id)
+        if queue_store is not None:
+            session.queue.journal = functools.partial(queue_store.record_queue, server_id)
+        SERVER_SESSIONS[server_id] = session
+    return session
+
+
+# Records the server's current track and voice channel in the queue store.
+def store_current(session, voice_client, position=0):
+    if queue_store is not None:
+        channel_id = None if voice_client is None else voice_client.channel.id
+        queue_store.record_current(session.server_id, session.track, channel_id, position)
+
+
+# Forgets everything about a server the bot is no longer in.
+def drop_session(server_id):
+    session = SERVER_SESSIONS.pop(server_id, None)
+    prefetcher.stop(server_id)
+    scheduler.cancel_server(server_id)
+    if queue_store is not None:
+        queue_store.record_drop(server_id)
+    if session is not None:
+        for playlist in session.playlists:
+            playlist.cancel()
+        player = session.player
+        session.player = None
+        if player is not None:
+            stop_player(player)
+
+
+# Returns the next count queued Tracks of the server.
+def get_upcoming_tracks(server_id, count):
+    session = SERVER_SESSIONS.get(server_id)
+    if session is None:
+        return []
+    return session.queue.peek(count)
+
+
+# Completion callback of a player; runs on the player's thread so it hands off to the event loop.
+def player_finished(server_id, player):
+    player.finished_at = time.time()
+    read_ahead = getattr(player, 'read_ahead', None)
+    if read_ahead is not None:
+        read_ahead.close()
+    asyncio.run_coroutine_threadsafe(advance_queue(server_id, player), bot.loop)
+
+
+# Starts the next song in the queue once the given player has finished.
+async def advance_queue(server_id, finished_player):
+    session = SERVER_SESSIONS.get(server_id)
+    if session is None:
+        return
+
+    async with session.lock:
+        # Already advanced (e.g. by skip) or reset.
+        if session.player is not finished_player:
+            return
+        if finished_player is not None:
+            finished_player.stop()
+        session.paused_at = None
+
+        server = bot.get_server(server_id)
+        voice_client = None if server is None else bot.voice_client_in(server)
+        if voice_client is None:
+            # Keep the queue for when the bot reconnects.
+            session.player = None
+            session.track = None
+            store_current(session, None)
+            return
+
+        # The player is only built now that the Track is about to play.
+        finished_at = getattr(finished_player, 'finished_at', time.time())
+        next_player = None
+        next_track = None
+        while next_player is None and len(session.queue) > 0:
+            next_track = session.queue.advance()
+            next_player = await start_track(voice_client, next_track, on_first_audio=lambda: metrics.observe(
+                'inter_track_gap_seconds', time.time() - finished_at))
+        session.player = next_player
+        session.track = next_track if next_player is not None else None
+        store_current(session, voice_client)
+        session.touch()
+
+
+# Resumes the session's suspended track for a command, joining the author's voice channel if needed.
+async def resume_command(ctx, session):
+    server = ctx.message.server
+    if server is None:
+        server = get_voice_connected_server(ctx.message.author)
+    voice_client = bot.voice_client_in(server)
+    if voice_client is None:
+        voice_client = await get_voice_client(ctx.message.author, server, None)
+    player = None if voice_client is None else await resume_suspended(session, voice_client)
+    if player is None:
+        await bot.say('Unable to resume playback.')
+    else:
+        await bot.say('Playback has resumed.', embed=player_info(player))
+
+
+# Stops the player. A paused discord.py player waits to be resumed before it looks at whether it was stopped,
+# so it is resumed too; otherwise its thread and completion callback would never finish.
+def stop_player(player):
+    player.stop()
+    player.resume()
+
+
+# Stops the session's player to free its FFmpeg process and voice resources, keeping its Track and position
+# so it can be resumed later; must be called with the session's lock held.
+def suspend_player(session, voice_client):
+    player = session.player
+    if player is None:
+        return
+    session.suspended_position = player_position(player)
+    # Cleared first so the player's completion callback does not advance the queue.
+    session.player = None
+    session.paused_at = None
+    stop_player(player)
+    prefetcher.cancel(session.server_id)
+    store_current(session, voice_client, session.suspended_position)
+
+
+# Starts a player for the session's suspended Track where it was stopped; returns the player or None.
+async def resume_suspended(session, voice_client):
+    async with session.lock:
+        if not session.is_suspended():
+            return session.player
+        position = session.suspended_position
+        player = await start_track(voice_client, session.track, position)
+        if player is None:
+            return None
+        session.player = player
+        session.suspended_position = 0
+        session.touch()
+        store_current(session, voice_client, position)
+        return player
+
+
+# Disconnects the bot from the server's voice channel, suspending whatever is playing.
+async def disconnect_idle(session, voice_client, reason):
+    async with session.lock:
+        suspend_player(session, voice_client)
+        store_current(session, None, session.suspended_position)
+    session.empty_since = None
+    await voice_client.disconnect()
+    metrics.inc('reaped_total', reason=reason)
+
+
+# Applies the reaper's timeouts to one server.
+async def reap_session(server_id, session, now):
+    server = bot.get_server(server_id)
+    voice_client = None if server is None else bot.voice_client_in(server)
+    if voice_client is not None:
+        listeners = [user_id for user_id in voice_states.members_of(voice_client.channel) if user_id != bot.user.id]
+        if len(listeners) > 0:
+            session.empty_since = None
+        elif session.empty_since is None:
+            session.empty_since = now
+        if EMPTY_CHANNEL_TIMEOUT and session.empty_since is not None \
+                and now - session.empty_since >= EMPTY_CHANNEL_TIMEOUT:
+            await disconnect_idle(session, voice_client, 'empty_channel')
+            return
+        if IDLE_TIMEOUT and session.player is None and len(session.playlists) == 0 \
+                and now - session.last_active >= IDLE_TIMEOUT:
+            await disconnect_idle(session, voice_client, 'idle')
+            return
+
+    if PAUSED_TIMEOUT and session.player is not None and session.paused_at is not None \
+            and now - session.paused_at >= PAUSED_TIMEOUT:
+        async with session.lock:
+            suspend_player(session, voice_client)
+        metrics.inc('reaped_total', reason='paused')
+    elif SESSION_TIMEOUT and voice_client is None and session.player is None and len(session.playlists) == 0 \
+            and now - session.last_active >= SESSION_TIMEOUT:
+        drop_session(server_id)
+        metrics.inc('reaped_total', reason='session')
+
+
+# Background task that releases voice connections, players and sessions that are no longer used.
+async def reap_idle():
     await bot.wait_until_ready()
 
-    global SERVER_PLAYERS, SERVER_QUEUES, SERVER_PLAYLISTS
+    while not bot.is_closed:
+        await asyncio.sleep(REAPER_INTERVAL)
+        now = time.time()
+        # Voice connections made with join but never played on get a session so they are timed too.
+        for voice_client in list(bot.voice_clients):
+            get_session(voice_client.server.id)
+        for server_id, session in list(SERVER_SESSIONS.items()):
+            try:
+                await reap_session(server_id, session, now)
+            except Exception as e:
+                exception_log_write(e, server=server_id)
+
+
+# Restores every server the queue store has a queue for.
+async def restore_sessions():
+    try:
+        states = await bot.loop.run_in_executor(None, queue_store.load)
+    except OSError as e:
+        exception_log_write(e)
+        return
+    for server_id, state in states.items():
+        bot.loop.create_task(restore_session(server_id, state))
+
+
+# Rebuilds the server's queue from stored metadata, rejoins its voice channel and resumes the track that was
+# playing where it left off. Only that track is resolved now; the rest are resolved when they come up.
+async def restore_session(server_id, state):
+    server = bot.get_server(server_id)
+    if server is None:
+        queue_store.record_drop(server_id)
+        return
+    if server_id in SERVER_SESSIONS:
+        return
+
+    session = get_session(server_id)
+    # The stored queue is already in the log.
+    journal = session.queue.journal
+    session.queue.journal = None
+    for record in state['queue']:
+        session.queue.append(Track.from_metadata(record['source'], record))
+    session.queue.journal = journal
+    if state['current'] is not None:
+        # Restored as suspended first, so the track is kept even if it cannot be started now, e.g. because the bot
+        # had left the channel for being idle.
+        session.track = Track.from_metadata(state['current']['source'], state['current'])
+        session.suspended_position = int(state['position'])
+
+    channel = None if state['channel'] is None else server.get_channel(state['channel'])
+    if channel is None:
+        return
+    voice_client = bot.voice_client_in(server)
+    try:
+        if voice_client is None:
+            voice_client = await bot.join_voice_channel(channel)
+    except Exception as e:
+        exception_log_write(e, server=server_id)
+        return
+
+    if session.is_suspended():
+        await resume_suspended(session, voice_client)
+        return
+    async with session.lock:
+        if session.player is not None or session.track is not None or len(session.queue) == 0:
+            return
+        track = session.queue.advance()
+        session.track = track
+        session.suspended_position = 0
+        player = await start_track(voice_client, track)
+        if player is not None:
+            session.player = player
+        store_current(session, voice_client)
+
+
+# Background task that creates and warms the youtube-dl instances before the first requests need them.
+async def warm_extractors():
+    futures = [bot.loop.run_in_executor(scheduler.thread_pool, warm_pools, EXTRACTION_WORKERS)]
+    if scheduler.process_pool is not None:
+        # One job per worker, though a worker may take several; one that takes none compiles the extractor
+        # patterns with its first extraction instead.
+        futures += [bot.loop.run_in_executor(scheduler.process_pool, warm_pools, 1, 1)
+                    for _ in range(scheduler.workers)]
+    try:
+        await asyncio.gather(*futures)
+    except Exception as e:
+        exception_log_write(e)
+
+
+# Background task that periodically writes the metadata cache to disk.
+async def metadata_cache_save():
+    await bot.wait_until_ready()
 
     while not bot.is_closed:
-        for server, player in SERVER_PLAYERS.items():
-            if player is not None:
-                if player.is_done():
-                    player.stop()
-                    try:
-                        if server in SERVER_QUEUES:
-                            SERVER_PLAYERS[server] = SERVER_QUEUES[server].pop(0)
-                            SERVER_PLAYERS[server].start()
-                    except IndexError:
-                        SERVER_PLAYERS[server] = None
-        await asyncio.sleep(1)
+        await asyncio.sleep(300)
+        try:
+            await bot.loop.run_in_executor(None, metadata_cache.save, metadata_cache.snapshot())
+        except OSError as e:
+            exception_log_write(e)
 
 
-# Background task that updates the queue list.
-async def playlist_check():
+# Background task that writes queue changes to the queue store and keeps the play positions up to date.
+async def queue_store_flush():
     await bot.wait_until_ready()
 
-    global SERVER_PLAYLISTS
+    ticks = 0
+    while not bot.is_closed:
+        await asyncio.sleep(QUEUE_STORE_INTERVAL)
+        ticks += 1
+        if ticks * QUEUE_STORE_INTERVAL >= 15:
+            ticks = 0
+            store_positions()
+        try:
+            if queue_store.needs_compaction():
+                # Everything pending is part of the snapshot.
+                queue_store.take_pending()
+                await bot.loop.run_in_executor(None, queue_store.compact, queue_store_states())
+            else:
+                await bot.loop.run_in_executor(None, queue_store.write, queue_store.take_pending())
+        except OSError as e:
+            exception_log_write(e)
+
+
+# Records how far into its track every playing server is.
+def store_positions():
+    for session in SERVER_SESSIONS.values():
+        if session.player is not None and session.track is not None and session.player.is_playing():
+            queue_store.record_position(session.server_id, player_position(session.player))
+
+
+# Returns the state of every server for compacting the queue store.
+def queue_store_states():
+    states = {}
+    for server_id, session in SERVER_SESSIONS.items():
+        if session.track is None and len(session.queue) == 0:
+            continue
+        server = bot.get_server(server_id)
+        voice_client = None if server is None else bot.voice_client_in(server)
+        position = session.suspended_position
+        if session.player is not None and session.track is not None:
+            position = player_position(session.player)
+        states[server_id] = QueueStore.state(session.track, None if voice_client is None else voice_client.channel.id,
+                                             position, session.queue)
+    return states
+
+
+# Returns the Command the message invokes, or None.
+def command_of(message):
+    if not message.content.startswith(CMD_PREFIX):
+        return None
+    words = message.content[len(CMD_PREFIX):].split(' ', 1)
+    return bot.commands.get(words[0])
+
+
+# Registers the metrics that are read when collected and hooks up the extraction timings.
+def register_metrics():
+    metrics.describe('command_latency_seconds', 'histogram', 'Time to handle a command.')
+    metrics.describe('extraction_seconds', 'histogram', 'Time youtube-dl took per extraction.')
+    metrics.describe('extraction_wait_seconds', 'histogram', 'Time extractions waited for a worker.')
+    metrics.describe('extraction_failures_total', 'counter', 'Extractions that raised.')
+    metrics.describe('time_to_first_audio_seconds', 'histogram', 'Time from a play command to its first audio.')
+    metrics.describe('inter_track_gap_seconds', 'histogram', 'Silence between one track ending and the next.')
+    metrics.describe('seek_seconds', 'histogram', 'Time from a seek command to audio at the new position.')
+    metrics.describe('read_ahead_underruns_total', 'counter', 'Times a player ran out of read-ahead audio.')
+    metrics.describe('loop_lag_seconds', 'histogram', 'How late the event loop ran a one second sleep.')
+    metrics.describe('reaped_total', 'counter', 'Voice connections, players and sessions released for being idle.')
+    metrics.collect('sessions', 'gauge', 'Servers with a session.', lambda: len(SERVER_SESSIONS))
+    metrics.collect('queued_tracks', 'gauge', 'Tracks queued over every server.',
+                    lambda: sum(len(session.queue) for session in SERVER_SESSIONS.values()))
+    metrics.collect('extraction_queue_depth', 'gauge', 'Extractions waiting for a worker.',
+                    lambda: dict((Metrics.labels(dict(priority=name)), depth)
+                                 for name, depth in scheduler.depth().items()))
+    metrics.collect('voice_clients', 'gauge', 'Connected voice clients.', lambda: len(list(bot.voice_clients)))
+    metrics.collect('read_ahead_frames', 'gauge', 'Audio frames buffered ahead of the players.',
+                    lambda: read_ahead_stats()['fill'])
+    metrics.collect('read_ahead_capacity_frames', 'gauge', 'Frames the players may buffer ahead at the moment.',
+                    lambda: read_ahead_stats()['capacity'])
+    metrics.collect('ffmpeg_processes', 'gauge', 'Running FFmpeg processes.', ffmpeg_processes)
+    metrics.collect('extractions_deduplicated_total', 'counter', 'Extraction requests that joined one in flight.',
+                    lambda: extractions.deduplicated)
+    metrics.collect('log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full.',
+                    lambda: log_writer.stats()['dropped'])
+    metrics.collect('cache_hits_total', 'counter', 'Cache hits.', lambda: cache_counts('hits'))
+    metrics.collect('cache_misses_total', 'counter', 'Cache misses.', lambda: cache_counts('misses'))
+    scheduler.observer = observe_extraction
+
+
+# Records the timings of a finished extraction.
+def observe_extraction(priority, wait, run_time, failed):
+    name = ExtractionScheduler.PRIORITY_NAMES[priority]
+    metrics.observe('extraction_seconds', run_time, priority=name)
+    metrics.observe('extraction_wait_seconds', wait, priority=name)
+    if failed:
+        metrics.inc('extraction_failures_total', priority=name)
+
+
+# Returns the number of FFmpeg processes the bot is running.
+def ffmpeg_processes():
+    count = 0
+    if broadcaster is not None:
+        count += broadcaster.stats()['active']
+    else:
+        count += sum(1 for session in SERVER_SESSIONS.values()
+                     if session.player is not None and not session.player.is_done())
+    if audio_cache is not None:
+        count += audio_cache.stats()['populating']
+    return count
+
+
+# Returns the hit or miss counter of every cache.
+def cache_counts(counter):
+    counts = dict((Metrics.labels(dict(cache=name)), table[counter])
+                  for name, table in metadata_cache.stats().items())
+    negative = failed_sources.hits if counter == 'hits' else failed_sources.misses
+    counts[Metrics.labels(dict(cache='negative'))] = negative
+    if audio_cache is not None:
+        counts[Metrics.labels(dict(cache='audio'))] = audio_cache.stats()[counter]
+    return counts
+
+
+# Background task that measures how late the event loop runs callbacks.
+async def measure_loop_lag():
+    await bot.wait_until_ready()
 
     while not bot.is_closed:
-        for server in SERVER_PLAYLISTS:
-            if len(SERVER_PLAYLISTS[server]) > 0:
-                if SERVER_PLAYLISTS[server][0].completed:
-                    playlist = SERVER_PLAYLISTS[server].pop(0)
-                    await create_player_list(playlist)
+        started = bot.loop.time()
         await asyncio.sleep(1)
+        metrics.observe('loop_lag_seconds', max(0.0, bot.loop.time() - started - 1))
+
+
+# Background task that periodically writes a summary of the metrics to the metrics log.
+async def metrics_log_summary():
+    await bot.wait_until_ready()
+
+    while not bot.is_closed:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        try:
+            await bot.loop.run_in_executor(None, metrics_log_write, metrics.summary())
+        except OSError as e:
+            exception_log_write(e)
+
+
+# Signal handler that stops bot.run like Ctrl+C does.
+def interrupt(signal_number, frame):
+    raise KeyboardInterrupt
+
+
+async def start_metrics_server():
+    try:
+        await metrics_server.start()
+    except OSError as e:
+        exception_log_write(e)
+
+
+initialize_services()
 
 
 # ----- Run Bot -----
 
 
-try:
-    bot.loop.create_task(queue_check())
-    bot.loop.create_task(playlist_check())
-    bot.run(BOT_TOKEN)
-except Exception as e:
-    exception_log_write(e)
-    pass
+# Guarded so extraction worker processes can import this module without starting the bot.
+if __name__ == '__main__':
+    # Stopping with SIGTERM, e.g. by the shard supervisor or a service manager, takes the same way out as
+    # Ctrl+C, so the state below is saved.
+    signal.signal(signal.SIGTERM, interrupt)
+    try:
+        coalescer.start(bot.loop)
+        bot.loop.create_task(warm_extractors())
+        if METADATA_CACHE_FILE is not None:
+            bot.loop.create_task(metadata_cache_save())
+        if queue_store is not None:
+            bot.loop.create_task(queue_store_flush())
+        bot.loop.create_task(measure_loop_lag())
+        if REAPER_INTERVAL:
+            bot.loop.create_task(reap_idle())
+        if METRICS_LOG_INTERVAL:
+            bot.loop.create_task(metrics_log_summary())
+        if metrics_server is not None:
+            bot.loop.create_task(start_metrics_server())
+        bot.run(BOT_TOKEN)
+    except Exception as e:
+        exception_log_write(e)
+        pass
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        scheduler.shutdown()
+        if audio_cache is not None:
+            audio_cache.shutdown()
+        metadata_cache.save(metadata_cache.snapshot())
+        if queue_store is not None:
+            store_positions()
+            queue_store.write(queue_store.take_pending())
+        log_writer.close()
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CircuitBreaker import CircuitBreaker
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(window=10, threshold=0.5, min_calls=4, backoff=5, max_backoff=20)
+
+    def open_breaker(self, now=0):
+        for success in (True, False, True, False):
+            self.assertTrue(self.breaker.allow('youtube', now))
+            self.breaker.record('youtube', success, now)
+
+    def state(self):
+        return self.breaker.stats()['backends']['youtube']
+
+    def test_stays_closed_below_the_threshold_or_minimum_calls(self):
+        for success in (False, False, False):
+            self.breaker.record('youtube', success, 0)
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+        for success in (True, True, True, True, True):
+            self.breaker.record('soundcloud', success, 0)
+        for success in (False, False, False, False):
+            self.breaker.record('soundcloud', success, 0)
+        self.assertEqual(self.breaker.stats()['backends']['soundcloud'], CircuitBreaker.CLOSED)
+
+    def test_opens_at_the_threshold_and_rejects_until_the_backoff_passed(self):
+        self.open_breaker()
+        self.assertEqual(self.state(), CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow('youtube', 4.9))
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+        # Other backends are not affected.
+        self.assertTrue(self.breaker.allow('soundcloud', 1))
+
+    def test_half_open_lets_one_trial_through(self):
+        self.open_breaker()
+        self.assertTrue(self.breaker.allow('youtube', 5))
+        self.assertEqual(self.state(), CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow('youtube', 5))
+
+    def test_successful_trial_closes(self):
+        self.open_breaker()
+        self.assertTrue(self.breaker.allow('youtube', 5))
+        self.breaker.record('youtube', True, 5)
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow('youtube', 5))
+        # The results before opening are forgotten.
+        self.breaker.record('youtube', False, 5)
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens_with_a_longer_backoff_up_to_the_maximum(self):
+        self.open_breaker()
+        now = 5
+        for backoff in (10, 20, 20):
+            self.assertTrue(self.breaker.allow('youtube', now))
+            self.breaker.record('youtube', False, now)
+            self.assertEqual(self.state(), CircuitBreaker.OPEN)
+            self.assertFalse(self.breaker.allow('youtube', now + backoff - 0.1))
+            now += backoff
+        self.assertEqual(self.breaker.stats()['opened'], 4)
+
+    def test_released_trial_lets_the_next_call_through(self):
+        self.open_breaker()
+        self.assertTrue(self.breaker.allow('youtube', 5))
+        self.breaker.release('youtube')
+        self.assertEqual(self.state(), CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow('youtube', 5))
+        self.assertFalse(self.breaker.allow('youtube', 5))
+
+    def test_release_does_nothing_unless_half_open(self):
+        self.breaker.release('youtube')
+        self.assertEqual(self.state(), CircuitBreaker.CLOSED)
+        self.open_breaker()
+        self.breaker.release('youtube')
+        self.assertFalse(self.breaker.allow('youtube', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
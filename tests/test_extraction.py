@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+from youtube_dl.utils import DownloadError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Extraction import is_backend_error
+
+
+# Errors of one video must not open the circuit breaker for its whole backend.
+class IsBackendErrorTest(unittest.TestCase):
+    def test_missing_video_is_not_a_backend_error(self):
+        error = DownloadError('ERROR: Unable to download webpage: HTTP Error 404: Not Found '
+                              '(caused by HTTPError()); please report this issue on https://yt-dl.org/bug .')
+        self.assertFalse(is_backend_error(error))
+
+    def test_blocked_or_broken_video_is_not_a_backend_error(self):
+        self.assertFalse(is_backend_error(DownloadError('ERROR: Unable to download webpage: HTTP Error 403: '
+                                                        'Forbidden')))
+        self.assertFalse(is_backend_error(DownloadError('ERROR: abc123: unable to extract uploader id')))
+
+    def test_server_errors_and_throttling_are_backend_errors(self):
+        self.assertTrue(is_backend_error(DownloadError('ERROR: Unable to download webpage: HTTP Error 500: '
+                                                       'Internal Server Error')))
+        self.assertTrue(is_backend_error(DownloadError('ERROR: Unable to download webpage: HTTP Error 429: '
+                                                       'Too Many Requests')))
+
+    def test_connection_errors_are_backend_errors(self):
+        self.assertTrue(is_backend_error(DownloadError('ERROR: Unable to download webpage: <urlopen error '
+                                                       '[Errno -3] Temporary failure in name resolution>')))
+        self.assertTrue(is_backend_error(DownloadError('ERROR: Unable to download webpage: The read operation '
+                                                       'timed out')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from QueueStore import QueueStore
+from Track import Track
+from TrackQueue import TrackQueue
+
+
+# The log is the only copy of a queue across a restart, so replaying it must give back the live queue.
+class QueueStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = QueueStore(os.path.join(self.directory, 'queues.log'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def journaled_queue(self, server_id):
+        queue = TrackQueue()
+        queue.journal = lambda op, *args: self.store.record_queue(server_id, op, *args)
+        return queue
+
+    @staticmethod
+    def track(number):
+        return Track('song {}'.format(number), url='https://www.youtube.com/watch?v={}'.format(number),
+                     title='Song {}'.format(number), duration=number)
+
+    def flush(self):
+        self.store.write(self.store.take_pending())
+
+    def assert_restored(self, states, server_id, queue):
+        self.assertEqual([record['url'] for record in states[server_id]['queue']], [track.url for track in queue])
+
+    def test_replays_every_queue_operation(self):
+        queue = self.journaled_queue('1')
+        for number in range(8):
+            queue.append(self.track(number))
+        queue.advance()
+        queue.remove(2)
+        queue.pop()
+        queue.move(0, 3)
+        queue.move(4, -1)
+        queue.move(1, 99)
+        self.flush()
+
+        self.assert_restored(self.store.load(), '1', queue)
+
+    def test_replays_random_operations_across_writes(self):
+        operations = random.Random(7)
+        queue = self.journaled_queue('1')
+        for step in range(500):
+            choice = operations.random()
+            if choice < 0.4 or len(queue) == 0:
+                queue.append(self.track(step))
+            elif choice < 0.55:
+                queue.advance()
+            elif choice < 0.7:
+                queue.remove(operations.randrange(len(queue)))
+            elif choice < 0.8:
+                queue.pop()
+            elif choice < 0.97:
+                queue.move(operations.randrange(len(queue)), operations.randrange(-2, len(queue) + 2))
+            else:
+                queue.clear()
+            if step % 37 == 0:
+                self.flush()
+        self.flush()
+
+        self.assert_restored(self.store.load(), '1', queue)
+
+    def test_keeps_servers_apart_and_forgets_dropped_ones(self):
+        first = self.journaled_queue('1')
+        second = self.journaled_queue('2')
+        first.append(self.track(1))
+        second.append(self.track(2))
+        second.append(self.track(3))
+        first.advance()
+        self.store.record_current('1', self.track(1), 'channel', 0)
+        self.store.record_position('1', 42)
+        self.store.record_drop('2')
+        self.flush()
+
+        states = self.store.load()
+        self.assertEqual(list(states), ['1'])
+        self.assertEqual(states['1']['current']['url'], self.track(1).url)
+        self.assertEqual(states['1']['channel'], 'channel')
+        self.assertEqual(states['1']['position'], 42)
+        self.assert_restored(states, '1', first)
+
+    def test_drops_a_cut_short_last_line_and_keeps_later_records(self):
+        queue = self.journaled_queue('1')
+        queue.append(self.track(1))
+        queue.append(self.track(2))
+        self.flush()
+        with open(self.store.path, 'a') as log_file:
+            log_file.write('["1", "app')
+
+        self.assert_restored(self.store.load(), '1', queue)
+        queue.advance()
+        self.flush()
+        self.assert_restored(QueueStore(self.store.path).load(), '1', queue)
+
+    def test_keeps_a_last_record_that_lost_only_its_newline(self):
+        queue = self.journaled_queue('1')
+        queue.append(self.track(1))
+        queue.append(self.track(2))
+        self.flush()
+        with open(self.store.path) as log_file:
+            contents = log_file.read()
+        with open(self.store.path, 'w') as log_file:
+            log_file.write(contents.rstrip('\n'))
+
+        self.assert_restored(self.store.load(), '1', queue)
+        queue.advance()
+        self.flush()
+        self.assert_restored(QueueStore(self.store.path).load(), '1', queue)
+
+    def test_compaction_keeps_the_state_and_later_records_apply_to_it(self):
+        queue = self.journaled_queue('1')
+        for number in range(5):
+            queue.append(self.track(number))
+        queue.remove(1)
+        self.store.record_current('1', self.track(9), 'channel', 30)
+        self.flush()
+
+        self.store.take_pending()
+        self.store.compact({'1': QueueStore.state(self.track(9), 'channel', 30, queue)})
+        self.assertEqual(self.store.stats()['logged'], 1 + len(queue))
+        queue.advance()
+        queue.append(self.track(7))
+        self.flush()
+
+        states = QueueStore(self.store.path).load()
+        self.assertEqual(states['1']['current']['url'], self.track(9).url)
+        self.assertEqual(states['1']['position'], 30)
+        self.assert_restored(states, '1', queue)
+
+    def test_needs_compaction_once_the_log_outgrows_the_limit(self):
+        store = QueueStore(self.store.path, compact_after=3)
+        queue = TrackQueue()
+        queue.journal = lambda op, *args: store.record_queue('1', op, *args)
+        for number in range(3):
+            queue.append(self.track(number))
+        self.assertFalse(store.needs_compaction())
+        queue.advance()
+        self.assertTrue(store.needs_compaction())
+
+
+if __name__ == '__main__':
+    unittest.main()